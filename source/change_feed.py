@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""
+Change feed of participations, pushed to the participation overviews over Server-Sent
+Events.
+
+Triggers on the participations and tickets tables append the id of every participation
+whose presence, ticket count or listed details change to participation_changes, so
+every write path (syncs, ticket collection, check-ins) feeds it in whichever worker it
+runs. Broadcaster polls that table once per event per worker and fans the changed
+rows out to the SSE clients of the worker. The sequence number of a change is its SSE
+event id, so a reconnecting client continues where it left off.
+"""
+
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from database import connection
+from logger import warning
+
+
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "0.5"))
+STREAM_KEEPALIVE_SECONDS = 15
+# Number of changes kept; clients that fell further behind reload the whole list
+FEED_RETENTION = 10000
+QUEUE_SIZE = 1000
+MAX_SEQ = 2**63 - 1
+
+
+def create_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS participation_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT,
+            participation_id TEXT
+        )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_participation_changes_event ON participation_changes(event_id, seq)")
+    record = "INSERT INTO participation_changes (event_id, participation_id) VALUES ({0}.event_id, {0}.{1});"
+    triggers = {
+        "tickets_changes_insert": f"AFTER INSERT ON tickets BEGIN {record.format('NEW', 'obj_id')} END",
+        "tickets_changes_update": f"""
+            AFTER UPDATE ON tickets
+            WHEN OLD.presence_count IS NOT NEW.presence_count OR OLD.ticket_count IS NOT NEW.ticket_count
+            BEGIN {record.format('NEW', 'obj_id')} END
+        """,
+        "participations_changes_insert": f"""
+            AFTER INSERT ON participations BEGIN {record.format('NEW', 'participation_id')} END
+        """,
+        "participations_changes_update": f"""
+            AFTER UPDATE ON participations
+            WHEN OLD.status IS NOT NEW.status OR OLD.member_id IS NOT NEW.member_id
+                OR OLD.addressee IS NOT NEW.addressee OR OLD.email IS NOT NEW.email
+            BEGIN {record.format('NEW', 'participation_id')} END
+        """,
+        "participations_changes_delete": f"""
+            AFTER DELETE ON participations BEGIN {record.format('OLD', 'participation_id')} END
+        """,
+        "participation_changes_prune": f"""
+            AFTER INSERT ON participation_changes WHEN NEW.seq % 1000 = 0
+            BEGIN DELETE FROM participation_changes WHERE seq <= NEW.seq - {FEED_RETENTION}; END
+        """,
+    }
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+
+def latest_seq() -> int:
+    with connection(readonly=True) as conn:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM participation_changes").fetchone()[0]
+
+
+def oldest_seq() -> int:
+    with connection(readonly=True) as conn:
+        return conn.execute("SELECT COALESCE(MIN(seq), 0) FROM participation_changes").fetchone()[0]
+
+
+def read_changes(event_id: str, after: int, until: Optional[int] = None) -> List[Tuple[int, str]]:
+    """
+    Function to read the changes of an event after a sequence number.
+
+    :return: (seq, participation_id) pairs in order
+    """
+
+    with connection(readonly=True) as conn:
+        return conn.execute(
+            """
+            SELECT seq, participation_id FROM participation_changes
+            WHERE event_id = ? AND seq > ? AND seq <= ?
+            ORDER BY seq
+        """,
+            (event_id, after, until if until is not None else MAX_SEQ),
+        ).fetchall()
+
+
+def format_message(seq: int, event: str, payload: Dict) -> str:
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+class Broadcaster:
+    """
+    Fans the change feed out to the SSE clients of this worker, polling the feed once
+    per event however many clients follow it.
+    """
+
+    def __init__(self, load_rows: Callable[[str, List[str]], List[Dict]], interval: float = STREAM_POLL_INTERVAL):
+        """
+        :param load_rows: Function returning the current rows of the given participations
+            of an event, as listed by GET /participations/{event_id}
+        :param interval: Seconds between polls of the feed
+        """
+
+        self.load_rows = load_rows
+        self.interval = interval
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._positions: Dict[str, int] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+
+    def _messages(self, event_id: str, after: int, until: Optional[int] = None) -> Tuple[List[Tuple[int, str, Dict]], int]:
+        changes = read_changes(event_id, after, until)
+        if not changes:
+            return [], after
+        # Several changes of one participation are sent once, with the last sequence number
+        last_seq = {participation_id: seq for seq, participation_id in changes}
+        rows = {str(row["id"]): row for row in self.load_rows(event_id, list(last_seq))}
+        messages = []
+        for participation_id, seq in sorted(last_seq.items(), key=lambda item: item[1]):
+            row = rows.get(participation_id, {"id": int(participation_id), "deleted": True})
+            messages.append((seq, "participation", row))
+        return messages, changes[-1][0]
+
+    def _publish(self, event_id: str, messages: List[Tuple[int, str, Dict]]):
+        for queue in self._subscribers.get(event_id, ()):
+            try:
+                for message in messages:
+                    queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # The client can't keep up; drop its backlog and have it reload the list
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait((messages[-1][0], "reload", {}))
+
+    async def _poll(self, event_id: str):
+        while self._subscribers.get(event_id):
+            await asyncio.sleep(self.interval)
+            try:
+                messages, position = await asyncio.to_thread(self._messages, event_id, self._positions[event_id])
+            except Exception as exc:
+                warning("Polling changes of event %s failed: %s", event_id, exc)
+                continue
+            self._positions[event_id] = position
+            if messages:
+                self._publish(event_id, messages)
+        del self._pollers[event_id]
+        del self._positions[event_id]
+
+    async def stream(self, event_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Function to generate the SSE messages of an event for one client.
+
+        :param event_id: Event to follow
+        :param last_event_id: Last-Event-ID sent by a reconnecting client
+        """
+
+        if event_id not in self._positions:
+            position = await asyncio.to_thread(latest_seq)
+            self._positions.setdefault(event_id, position)
+        # Everything after this position reaches the queue; catch up to it separately
+        position = self._positions[event_id]
+        queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        self._subscribers.setdefault(event_id, set()).add(queue)
+        if event_id not in self._pollers:
+            self._pollers[event_id] = asyncio.create_task(self._poll(event_id))
+
+        try:
+            yield "retry: 3000\n\n"
+            sent = position
+            last = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+            if last is None:
+                yield format_message(position, "ready", {})
+            elif last < await asyncio.to_thread(oldest_seq) - 1:
+                yield format_message(position, "reload", {})
+            else:
+                messages, _ = await asyncio.to_thread(self._messages, event_id, last, position)
+                for message in messages:
+                    yield format_message(*message)
+
+            while True:
+                try:
+                    seq, event, payload = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if seq > sent or event == "reload":
+                    sent = max(sent, seq)
+                    yield format_message(seq, event, payload)
+        finally:
+            self._subscribers[event_id].discard(queue)
+            if not self._subscribers[event_id]:
+                del self._subscribers[event_id]
+
+    def stats(self) -> Dict:
+        return {event_id: len(queues) for event_id, queues in self._subscribers.items()}
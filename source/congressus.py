@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+"""
+Async client for the Congressus API.
+
+Paginated collections are fetched by requesting the first page, and then requesting
+all remaining pages concurrently. The number of requests in flight is limited per
+process by CONGRESSUS_CONCURRENCY.
+
+All requests go through CongressusTransport, which draws from one token bucket per
+process, retries 429, 5xx and connection errors with jittered exponential backoff,
+honors Retry-After, and counts calls per endpoint and status code. CONGRESSUS_RATE_LIMIT
+is the total of the pod, so each of its WEB_CONCURRENCY uvicorn workers gets an equal
+share of it.
+
+AdaptiveLimiter lets bulk jobs find the concurrency the upstream can take: it adds a
+slot for every window of fast, successful requests and halves on errors or slow ones.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+import metrics
+from logger import warning
+
+
+API_URL = "https://api.congressus.nl/v30"
+PAGE_SIZE = 100
+# Ceilings; ticket collection lowers its concurrency on errors and slow responses, and a 429
+# pauses the token bucket for its Retry-After
+CONCURRENCY = int(os.getenv("CONGRESSUS_CONCURRENCY", "16"))
+# Totals of all workers; uvicorn also takes its number of workers from WEB_CONCURRENCY
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+RATE_LIMIT = float(os.getenv("CONGRESSUS_RATE_LIMIT", "100"))
+RATE_BURST = int(os.getenv("CONGRESSUS_RATE_BURST", "20"))
+MAX_RETRIES = int(os.getenv("CONGRESSUS_MAX_RETRIES", "4"))
+TIMEOUT = 10.0
+# A check-in at the gate gives up quickly and is queued; the ticket queue retries it with backoff
+CHECK_IN_TIMEOUT = float(os.getenv("CONGRESSUS_CHECK_IN_TIMEOUT", "3"))
+CHECK_IN_MAX_RETRIES = int(os.getenv("CONGRESSUS_CHECK_IN_MAX_RETRIES", "0"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A request slower than this many times the fastest recent request counts as congestion
+LATENCY_TOLERANCE = float(os.getenv("CONGRESSUS_LATENCY_TOLERANCE", "3"))
+# ...unless it is faster than this anyway (jitter on very fast responses is not congestion)
+LATENCY_FLOOR = 0.05
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every caller in the process.
+
+    reserve() hands out tokens that may lie in the future, so concurrent callers queue
+    up in order instead of all waking up at the same moment.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Function to take one token.
+
+        :return: Seconds the caller has to wait before its token is available
+        """
+
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Function to hold back every caller for the given time, e.g. after a 429.
+        """
+
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+BUCKET = TokenBucket(RATE_LIMIT / WORKERS, max(1, RATE_BURST // WORKERS))
+_STATS: Dict[str, Dict] = {}
+_STATS_LOCK = threading.Lock()
+NUMERIC_SEGMENT = re.compile(r"/\d+")
+# (seconds of the last attempt, attempts) of the last request made in this task. Set by
+# the transport so AdaptiveLimiter can judge the upstream without the rate limit waits.
+LAST_CALL: contextvars.ContextVar[Optional[Tuple[float, int]]] = contextvars.ContextVar("LAST_CALL", default=None)
+
+
+def endpoint_name(request: httpx.Request) -> str:
+    """
+    Function to turn a request into a low-cardinality endpoint name,
+    e.g. "GET /events/{id}/participations".
+    """
+
+    path = request.url.path
+    if path.startswith("/v30"):
+        path = path[len("/v30"):]
+    return f"{request.method} {NUMERIC_SEGMENT.sub('/{id}', path)}"
+
+
+def record(endpoint: str, outcome: str, seconds: float, retried: bool = False):
+    with _STATS_LOCK:
+        counters = _STATS.setdefault(endpoint, {"requests": 0, "retries": 0, "seconds": 0.0, "outcomes": {}})
+        counters["requests"] += 1
+        counters["retries"] += retried
+        counters["seconds"] += seconds
+        counters["outcomes"][outcome] = counters["outcomes"].get(outcome, 0) + 1
+    metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=outcome)
+    metrics.UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def stats() -> Dict:
+    """
+    Function to return the per-endpoint call counters of this process.
+    """
+
+    with _STATS_LOCK:
+        return {
+            endpoint: dict(counters, outcomes=dict(counters["outcomes"]))
+            for endpoint, counters in _STATS.items()
+        }
+
+
+def backoff(attempt: int) -> float:
+    # "Equal jitter": half of the exponential delay is fixed, the other half random
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+class CongressusTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport adding the shared rate limit, retries and call counters. A request
+    can lower the number of retries with the "max_retries" extension.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, bucket: TokenBucket = BUCKET, max_retries: int = MAX_RETRIES):
+        self.transport = transport
+        self.bucket = bucket
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_name(request)
+        max_retries = request.extensions.get("max_retries", self.max_retries)
+        for attempt in range(max_retries + 1):
+            await self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as exc:
+                LAST_CALL.set((time.perf_counter() - start, attempt + 1))
+                record(endpoint, type(exc).__name__, time.perf_counter() - start, retried=attempt > 0)
+                if attempt == max_retries:
+                    raise
+                delay = backoff(attempt)
+                warning("%s failed with %s, retrying in %.1fs", endpoint, type(exc).__name__, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            LAST_CALL.set((time.perf_counter() - start, attempt + 1))
+            record(endpoint, str(response.status_code), time.perf_counter() - start, retried=attempt > 0)
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff(attempt)
+            if response.status_code == 429:
+                # Everyone in this process backs off, not only this request
+                self.bucket.pause(delay)
+            await response.aclose()
+            warning("%s returned %s, retrying in %.1fs", endpoint, response.status_code, delay)
+            await asyncio.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that follows the upstream (additive increase, multiplicative
+    decrease).
+
+    Every successful request within LATENCY_TOLERANCE of the baseline latency grows the
+    limit by 1/limit, so roughly one slot per window of requests. A failed, retried or
+    slow request halves it, at most once per window: requests that started before the
+    last decrease do not decrease it again. Latency is the upstream time reported by
+    CongressusTransport, so waiting for the rate limit does not count as slowness.
+    """
+
+    def __init__(self, maximum: int = CONCURRENCY, minimum: int = 1, initial: Optional[int] = None):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial or max(minimum, maximum // 2))
+        self.in_flight = 0
+        self.peak = int(self.limit)
+        self.decreases = 0
+        self.baseline: Optional[float] = None
+        self._decreased_at = 0.0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Function to wait for a free slot and hold it for the duration of the block.
+        An exception raised in the block counts as a failed request.
+        """
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        start = time.monotonic()
+        LAST_CALL.set(None)
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            seconds, attempts = LAST_CALL.get() or (time.monotonic() - start, 1)
+            async with self._condition:
+                self.in_flight -= 1
+                self._update(start, seconds, ok and attempts == 1)
+                self._condition.notify(max(0, int(self.limit) - self.in_flight))
+
+    def _update(self, start: float, seconds: float, ok: bool):
+        if ok:
+            # Slowly forget the fastest latency, so the baseline follows the upstream
+            self.baseline = seconds if self.baseline is None else min(seconds, self.baseline * 1.01)
+        if ok and seconds <= max(self.baseline * LATENCY_TOLERANCE, LATENCY_FLOOR):
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.peak = max(self.peak, int(self.limit))
+        elif start >= self._decreased_at:
+            self.limit = max(self.minimum, self.limit / 2)
+            self.decreases += 1
+            self._decreased_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {"limit": int(self.limit), "peak": self.peak, "decreases": self.decreases}
+
+
+class CongressusClient:
+    """
+    Thin wrapper around httpx.AsyncClient for the Congressus API.
+
+    The underlying httpx client and semaphore are created on first use, so they
+    belong to the event loop that actually runs the requests. The API key is read then
+    too, so importing the app does not need it.
+    """
+
+    def __init__(
+        self,
+        api_key: Union[str, Callable[[], str]],
+        concurrency: int = CONCURRENCY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        :param api_key: The API key, or a function returning it; called on first use
+        """
+
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def headers(self) -> Dict[str, str]:
+        if callable(self.api_key):
+            self.api_key = self.api_key()
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=API_URL,
+                headers=self.headers(),
+                timeout=TIMEOUT,
+                transport=CongressusTransport(self.transport or httpx.AsyncHTTPTransport()),
+                limits=httpx.Limits(max_connections=self.concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._client
+
+    async def get(self, path: str, params: Optional[Dict] = None) -> Dict:
+        """
+        Function to GET a single resource and return the decoded JSON body.
+
+        :param path: Path relative to API_URL, e.g. /events/1/participations/2
+        :param params: Optional query parameters
+        """
+
+        client = self._ensure_client()
+        async with self._semaphore:
+            resp = await client.get(path, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def post(
+        self, path: str, payload: Dict, timeout: Optional[float] = None, max_retries: Optional[int] = None
+    ) -> httpx.Response:
+        """
+        Function to POST a JSON payload and return the raw response.
+
+        :param path: Path relative to API_URL
+        :param payload: JSON body
+        :param timeout: Timeout instead of TIMEOUT
+        :param max_retries: Retries instead of MAX_RETRIES
+        """
+
+        client = self._ensure_client()
+        extensions = {"max_retries": max_retries} if max_retries is not None else None
+        async with self._semaphore:
+            resp = await client.post(
+                path,
+                json=payload,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                extensions=extensions,
+            )
+        resp.raise_for_status()
+        return resp
+
+    async def get_paginated(self, path: str) -> List[Dict]:
+        """
+        Function to fetch every page of a paginated collection.
+
+        The first page tells how many pages there are; those are then fetched
+        concurrently. When the API does not report a page count, the remaining
+        pages are followed one by one via next_num.
+
+        :param path: Path relative to API_URL, e.g. /events
+        """
+
+        params = {"page_size": PAGE_SIZE, "page": 1}
+        page = await self.get(path, params=params)
+        data = list(page.get("data", []))
+        if not page.get("has_next", False):
+            return data
+
+        pages = page.get("pages")
+        if pages is None and page.get("total") is not None:
+            pages = math.ceil(page["total"] / PAGE_SIZE)
+
+        if pages is None:
+            while page.get("has_next", False):
+                params = {"page_size": PAGE_SIZE, "page": page.get("next_num", params["page"] + 1)}
+                page = await self.get(path, params=params)
+                data += page.get("data", [])
+            return data
+
+        remaining = await asyncio.gather(
+            *(self.get(path, params={"page_size": PAGE_SIZE, "page": number}) for number in range(2, pages + 1))
+        )
+        for page in remaining:
+            data += page.get("data", [])
+        return data
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
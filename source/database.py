@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+"""
+SQLite storage helpers for the Congressus cache.
+
+connection() hands out one reusable connection per thread (and per mode), tuned once
+with the PRAGMAs below. Read-only connections are opened with query_only, so GET paths
+can never take the write lock by accident. Write blocks start with BEGIN IMMEDIATE, so
+they wait for the write lock up front (timed as sqlite_lock_wait_seconds) instead of
+failing with SQLITE_BUSY when a read has to be upgraded to a write. Connections of
+threads that have exited are closed the next time a connection is opened, and
+close_all() closes the rest on shutdown.
+
+A worker can hold two connections for each of its threads (the threadpool alone has 40),
+so the page cache per connection is small and SQLite's heap of the whole process is
+capped by soft_heap_limit; beyond it SQLite frees cached pages. Reads are mostly served
+from the memory map, whose pages belong to the OS page cache and are shared by all
+connections and workers.
+
+delta_sync() writes a batch of API records to a table. Every row stores a hash of its
+content, so a sync only touches rows that are new or changed, and only deletes rows
+that are no longer returned by the API.
+
+migrate() applies numbered schema migrations, tracked in PRAGMA user_version.
+
+BulkWriter buffers rows that arrive one by one (e.g. tickets fetched concurrently) and
+writes them with executemany, one transaction per batch.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+
+
+DB_PATH = os.getenv("CONGRESSUS_CACHE_DB", "/db/congressus_cache.db")
+BATCH_SIZE = int(os.getenv("CONGRESSUS_WRITE_BATCH_SIZE", "200"))
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -int(os.getenv("CONGRESSUS_SQLITE_CACHE_KB", "2048")),
+    "mmap_size": int(os.getenv("CONGRESSUS_SQLITE_MMAP_BYTES", str(64 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+    # Applies to the whole process, not only this connection
+    "soft_heap_limit": int(os.getenv("CONGRESSUS_SQLITE_HEAP_BYTES", str(16 * 1024 * 1024))),
+}
+
+
+class ConnectionPool:
+    """
+    Per-thread SQLite connections that are opened once and reused.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (thread ident, readonly) -> connection, so connections of exited threads can be closed
+        self._connections: Dict[Tuple[int, bool], sqlite3.Connection] = {}
+        self._stats = {"opened": 0, "closed": 0, "reused": 0, "read_checkouts": 0, "write_checkouts": 0}
+
+    def _open(self, readonly: bool) -> sqlite3.Connection:
+        # check_same_thread is off so close_all()/_prune() may close connections of
+        # other threads; during normal use a connection never leaves its thread.
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        for pragma, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            # Persistent in the database file; cannot be changed inside a transaction
+            conn.execute("PRAGMA journal_mode = WAL")
+        with self._lock:
+            self._prune()
+            self._connections[(threading.get_ident(), readonly)] = conn
+            self._stats["opened"] += 1
+        return conn
+
+    def _prune(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        for key in [key for key in self._connections if key[0] not in alive]:
+            self._connections.pop(key).close()
+            self._stats["closed"] += 1
+
+    @contextlib.contextmanager
+    def connection(self, readonly: bool = False) -> Iterator[sqlite3.Connection]:
+        """
+        Function to borrow this thread's connection.
+
+        A write connection is committed when the outermost block exits and rolled back
+        on an exception. Nested blocks in the same thread share the connection and
+        the transaction.
+
+        :param readonly: Return the query_only connection of this thread
+        """
+
+        attribute = "readonly" if readonly else "readwrite"
+        conn = getattr(self._local, attribute, None)
+        if conn is None:
+            conn = self._open(readonly)
+            setattr(self._local, attribute, conn)
+            reused = False
+        else:
+            reused = True
+        with self._lock:
+            self._stats["reused"] += reused
+            self._stats["read_checkouts" if readonly else "write_checkouts"] += 1
+
+        depth_attribute = f"{attribute}_depth"
+        depth = getattr(self._local, depth_attribute, 0)
+        start = time.perf_counter()
+        if depth == 0 and not readonly and not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+            metrics.SQLITE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+        setattr(self._local, depth_attribute, depth + 1)
+        try:
+            yield conn
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+            raise
+        else:
+            if depth == 0 and not readonly:
+                conn.commit()
+        finally:
+            setattr(self._local, depth_attribute, depth)
+            if depth == 0:
+                metrics.SQLITE_TRANSACTION_SECONDS.observe(time.perf_counter() - start, mode=attribute)
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+                self._stats["closed"] += 1
+            self._connections.clear()
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, open=len(self._connections))
+
+
+POOL = ConnectionPool(DB_PATH)
+connection = POOL.connection
+
+
+def migrate(migrations: List[Tuple[int, Callable[[sqlite3.Cursor], None]]]) -> int:
+    """
+    Function to bring the schema up to date.
+
+    Every migration runs once, in order, and records its number in PRAGMA user_version.
+    The migrations run in one IMMEDIATE transaction (as every write block does), so when
+    several uvicorn workers start at the same time, one of them migrates and the others
+    wait and then skip.
+
+    :param migrations: (version, function) pairs in ascending version order
+    :return: Schema version after migrating
+    """
+
+    with connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        cursor = conn.cursor()
+        for number, step in migrations:
+            if number <= version:
+                continue
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            version = number
+    return version
+
+
+def add_column(cursor: sqlite3.Cursor, table: str, column: str, column_type: str):
+    """
+    Function to add a column unless it exists already (databases created by versions
+    of the app from before the migrations may have some of them).
+    """
+
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def content_hash(record: Dict) -> str:
+    """
+    Function to compute a stable hash of an API record, independent of key order.
+    """
+
+    encoded = json.dumps(record, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def delta_sync(
+    cursor: sqlite3.Cursor,
+    table: str,
+    key_column: str,
+    records: Dict[str, Dict],
+    scope: Optional[Tuple[str, str]] = None,
+    columns: Optional[Dict[str, Callable[[Dict], Any]]] = None,
+) -> Dict:
+    """
+    Function to bring a table in line with the records returned by the API.
+
+    Rows are compared by content hash: new rows are inserted, rows with a different
+    hash are updated and rows that are no longer returned are deleted. Unchanged rows
+    are not written, so their last_updated keeps pointing at the last real change.
+
+    :param cursor: Cursor of the connection holding the write transaction
+    :param table: Table with key_column, data, last_updated and content_hash columns
+    :param key_column: Primary key column of the table
+    :param records: API records by primary key
+    :param scope: Optional (column, value) limiting the sync to a subset of the table,
+        e.g. ("event_id", "123") for the participations of one event
+    :param columns: Optional typed columns to fill next to the JSON blob, as a
+        mapping of column name to a function extracting the value from a record
+    :return: Counts of inserted/updated/deleted/unchanged rows and the changed keys
+    """
+
+    if scope:
+        cursor.execute(f"SELECT {key_column}, content_hash FROM {table} WHERE {scope[0]} = ?", (scope[1],))
+    else:
+        cursor.execute(f"SELECT {key_column}, content_hash FROM {table}")
+    existing = dict(cursor.fetchall())
+
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    inserted = []
+    updated = []
+    rows = []
+    for key, record in records.items():
+        digest = content_hash(record)
+        if key not in existing:
+            inserted.append(key)
+        elif existing[key] != digest:
+            updated.append(key)
+        else:
+            continue
+        row = (key,) + ((scope[1],) if scope else ()) + (json.dumps(record), now, digest)
+        row += tuple(extract(record) for extract in (columns or {}).values())
+        rows.append(row)
+    deleted = existing.keys() - records.keys()
+
+    names = [key_column] + ([scope[0]] if scope else []) + ["data", "last_updated", "content_hash"]
+    names += list(columns or {})
+    if rows:
+        cursor.executemany(
+            f"""
+            INSERT INTO {table} ({", ".join(names)})
+            VALUES ({", ".join("?" for _ in names)})
+            ON CONFLICT({key_column}) DO UPDATE SET
+                {", ".join(f"{name} = excluded.{name}" for name in names[1:])}
+        """,
+            rows,
+        )
+    if deleted:
+        cursor.executemany(f"DELETE FROM {table} WHERE {key_column} = ?", [(key,) for key in deleted])
+
+    return {
+        "inserted": len(inserted),
+        "updated": len(updated),
+        "deleted": len(deleted),
+        "unchanged": len(records) - len(inserted) - len(updated),
+        "changed_keys": inserted + updated + sorted(deleted),
+    }
+
+
+class BulkWriter:
+    """
+    Buffers rows for a single INSERT statement and writes them in batches.
+
+    Rows can be added from the event loop while a flush runs in a worker thread;
+    the buffer is swapped under a lock so no row is lost or written twice.
+    """
+
+    def __init__(
+        self,
+        statement: str,
+        batch_size: int = BATCH_SIZE,
+        after_flush: Optional[Callable[[sqlite3.Cursor, List[Tuple]], None]] = None,
+    ):
+        """
+        :param statement: INSERT statement with one placeholder per row value
+        :param batch_size: Number of buffered rows after which the writer is full
+        :param after_flush: Optional callback run in the same transaction after each
+            batch, e.g. to update aggregates for the written rows
+        """
+
+        self.statement = statement
+        self.batch_size = batch_size
+        self.after_flush = after_flush
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self._buffer: List[Tuple] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, row: Tuple):
+        with self._lock:
+            self._buffer.append(row)
+
+    @property
+    def full(self) -> bool:
+        return len(self._buffer) >= self.batch_size
+
+    def flush(self) -> int:
+        """
+        Function to write all buffered rows in one transaction.
+
+        :return: Number of rows written
+        """
+
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        start = time.perf_counter()
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(self.statement, rows)
+            if self.after_flush is not None:
+                self.after_flush(cursor, rows)
+        self.write_seconds += time.perf_counter() - start
+        self.rows_written += len(rows)
+        return len(rows)
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.write_seconds == 0:
+            return 0.0
+        return self.rows_written / self.write_seconds
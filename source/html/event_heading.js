@@ -1,13 +1,11 @@
 // Fetch event details and update heading and date subtitle
 async function fetchEventDetails(eventId) {
     try {
-        const response = await fetch(`/events`);
-        const events = await response.json();
-        const event = events.find(e => String(e.id) === String(eventId));
-        if (event) {
-            const dateOnly = event.start ? event.start.split('T')[0] : '';
-            document.getElementById('eventHeading').textContent = event.name;
-            document.getElementById('eventDate').textContent = dateOnly;
-        }
+        const response = await fetch(`/events/${eventId}/summary?fields=name,start`);
+        if (!response.ok) return;
+        const event = await response.json();
+        const dateOnly = event.start ? event.start.split('T')[0] : '';
+        document.getElementById('eventHeading').textContent = event.name;
+        document.getElementById('eventDate').textContent = dateOnly;
     } catch {}
 }
@@ -16,21 +16,30 @@ async function confirmAndForceSync() {
 	return true;
 }
 
+// Start a refresh, show its progress, and reload the events once it has finished
+async function forceSync() {
+	const statusText = document.getElementById("api-status");
+	try {
+		const resp = await fetch("/events/refresh");
+		const data = await resp.json();
+		if (data.status !== "accepted") return;
+		showForceSyncMsg();
+		const job = await waitForJob(data.job_url, (job) => {
+			statusText.innerHTML = `<span class="w-2 h-2 rounded-full bg-amber-500 animate-pulse"></span> ${formatJobProgress(job)}`;
+		});
+		if (job.status === "failed") {
+			statusText.innerHTML = `<span class="w-2 h-2 rounded-full bg-red-500"></span> Sync failed: ${job.message || "unknown error"}`;
+			return;
+		}
+	} catch {}
+	fetchEvents();
+}
+
 // Hidden force sync: Ctrl+Shift+R (desktop)
 document.addEventListener("keydown", async (e) => {
 	if (e.ctrlKey && e.shiftKey && e.key.toLowerCase() === "r") {
 		if (await confirmAndForceSync()) {
-			try {
-				const resp = await fetch("/events/refresh");
-				const data = await resp.json();
-				if (data.status === "accepted") {
-					document.getElementById("api-status").innerHTML =
-						`<span class="w-2 h-2 rounded-full bg-amber-500 animate-pulse"></span> Syncing in background...`;
-					showForceSyncMsg();
-				}
-			} catch {}
-			// We don't wait for sync to finish, just reload cached data
-			fetchEvents();
+			forceSync();
 		}
 	}
 });
@@ -41,16 +50,7 @@ const syncBtn = document.getElementById("syncBtn");
 syncBtn.addEventListener("touchstart", () => {
 	forceSyncTimeout = setTimeout(async () => {
 		if (await confirmAndForceSync()) {
-			try {
-				const resp = await fetch("/events/refresh");
-				const data = await resp.json();
-				if (data.status === "accepted") {
-					document.getElementById("api-status").innerHTML =
-						`<span class="w-2 h-2 rounded-full bg-amber-500 animate-pulse"></span> Syncing in background...`;
-					showForceSyncMsg();
-				}
-			} catch {}
-			fetchEvents();
+			forceSync();
 		}
 	}, 2000); // 2 seconds long-press
 });
@@ -0,0 +1,33 @@
+// jobs.js - follow background jobs started by the backend
+
+// Poll a job until it is no longer queued or running, and return its final state.
+// onProgress is called with the job state after every poll. Gives up after timeout
+// milliseconds, so a page never waits forever for a job that stopped reporting.
+async function waitForJob(jobUrl, onProgress, interval = 1000, timeout = 15 * 60 * 1000) {
+	const deadline = Date.now() + timeout;
+	let missing = 0;
+	while (true) {
+		if (Date.now() > deadline) {
+			throw new Error("Job did not finish within " + timeout / 1000 + " seconds");
+		}
+		const response = await fetch(jobUrl);
+		if (response.ok) {
+			const job = await response.json();
+			if (onProgress) onProgress(job);
+			if (job.status !== "queued" && job.status !== "running") return job;
+		} else if (response.status !== 404 || ++missing > 5) {
+			// A job that was just started may not be registered for a moment
+			throw new Error("Job status unavailable: " + response.statusText);
+		}
+		await new Promise((resolve) => setTimeout(resolve, interval));
+	}
+}
+
+function formatJobProgress(job) {
+	let text = job.message || "Syncing";
+	if (job.total !== null && job.total !== undefined) {
+		text += ` ${job.processed} / ${job.total}`;
+	}
+	if (job.errors) text += ` (${job.errors} errors)`;
+	return text;
+}
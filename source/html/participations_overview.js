@@ -40,18 +40,23 @@ async function confirmAndForceSync() {
 	return true;
 }
 
+// Start a refresh and reload the participations once it has finished
+async function forceSync() {
+	try {
+		const resp = await fetch(`/participations/${eventId}/refresh`);
+		const data = await resp.json();
+		if (data.status !== "accepted") return;
+		await waitForJob(data.job_url);
+		showForceSyncMsg();
+	} catch {}
+	fetchParticipations(eventId);
+}
+
 // Hidden force sync: Ctrl+Shift+R (desktop)
 document.addEventListener("keydown", async (e) => {
 	if (e.ctrlKey && e.shiftKey && e.key.toLowerCase() === "r") {
 		if (eventId && (await confirmAndForceSync())) {
-			try {
-				const resp = await fetch(`/participations/${eventId}/refresh`);
-				const data = await resp.json();
-				if (data.status === "accepted") {
-					showForceSyncMsg();
-				}
-			} catch {}
-			fetchParticipations(eventId);
+			forceSync();
 		}
 	}
 });
@@ -63,14 +68,7 @@ if (syncBtn) {
 	syncBtn.addEventListener("touchstart", () => {
 		forceSyncTimeout = setTimeout(async () => {
 			if (eventId && (await confirmAndForceSync())) {
-				try {
-					const resp = await fetch(`/participations/${eventId}/refresh`);
-					const data = await resp.json();
-					if (data.status === "accepted") {
-						showForceSyncMsg();
-					}
-				} catch {}
-				fetchParticipations(eventId);
+				forceSync();
 			}
 		}, 2000); // 2 seconds long-press
 	});
@@ -285,12 +283,41 @@ const eventId = params.get("event_id");
 console.log("Parsed eventId:", eventId);
 if (eventId) {
 	fetchParticipations(eventId);
+	subscribeToChanges(eventId);
 	if (typeof fetchEventDetails === "function") fetchEventDetails(eventId);
 } else {
 	console.error("No event ID in URL params");
 	document.getElementById("loading").textContent = "No event ID provided.";
 }
 
+// Apply participations pushed by the backend when they change (check-ins on other
+// devices, syncs), instead of refetching the whole list
+function subscribeToChanges(eventId) {
+	if (!window.EventSource) return;
+	const source = new EventSource(`/participations/${eventId}/stream`);
+	let renderPending = false;
+	source.addEventListener("participation", (e) => {
+		const change = JSON.parse(e.data);
+		const index = participationsRawData.findIndex((p) => p.id === change.id);
+		if (change.deleted) {
+			if (index >= 0) participationsRawData.splice(index, 1);
+		} else if (index >= 0) {
+			participationsRawData[index] = change;
+		} else {
+			participationsRawData.push(change);
+		}
+		// Render once per frame, however many changes arrive
+		if (!renderPending) {
+			renderPending = true;
+			requestAnimationFrame(() => {
+				renderPending = false;
+				renderTable();
+			});
+		}
+	});
+	source.addEventListener("reload", () => fetchParticipations(eventId));
+}
+
 // Collect all tickets for this event
 async function collectAllTickets() {
 	if (!eventId) return;
@@ -304,15 +331,20 @@ async function collectAllTickets() {
 		);
 		const data = await response.json();
 		if (data.status === "accepted") {
-			// Show message that it's starting
+			// Show progress while the collection runs, and reload once it has finished
 			const statusMsg = document.getElementById("forceSyncMsg");
-			statusMsg.textContent = "Collection started in background!";
 			statusMsg.classList.remove("hidden");
+			const job = await waitForJob(data.job_url, (job) => {
+				statusMsg.textContent = formatJobProgress(job);
+			});
+			statusMsg.textContent =
+				job.status === "finished"
+					? `Collected ${job.processed} tickets`
+					: `Collection failed: ${job.message || "unknown error"}`;
 			setTimeout(() => {
 				statusMsg.classList.add("hidden");
 				statusMsg.textContent = "Force sync complete!";
 			}, 3000);
-			// Show cached data immediately
 			fetchParticipations(eventId);
 		} else {
 			alert("Failed to start collection: " + (data.message || "Unknown error"));
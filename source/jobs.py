@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Registry of background jobs (syncs and ticket collections), stored in SQLite so every
+uvicorn worker can answer GET /jobs/{id}, whichever worker runs the job.
+
+A job is created when a sync is started and uses the sync's run id as its id, so
+clients that are attached to a running sync poll the same job. While the job runs,
+progress() records processed/total/error counts; writes are throttled to one per
+JOB_UPDATE_INTERVAL seconds, so reporting progress per item is cheap. A job whose
+worker died is reported as failed once the lease of its sync run has expired.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import metrics
+from database import connection
+
+
+JOB_UPDATE_INTERVAL = float(os.getenv("JOB_UPDATE_INTERVAL", "0.5"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+FIELDS = ["job_id", "kind", "status", "processed", "total", "errors", "message", "result", "created", "started", "updated", "finished"]
+
+# Job of the running task, so sync functions can report progress without passing it around
+CURRENT_JOB: contextvars.ContextVar[Optional["Progress"]] = contextvars.ContextVar("CURRENT_JOB", default=None)
+
+
+def create_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT,
+            status TEXT,
+            processed INTEGER DEFAULT 0,
+            total INTEGER,
+            errors INTEGER DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            created REAL,
+            started REAL,
+            updated REAL,
+            finished REAL
+        )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created)")
+
+
+def create(job_id: str, kind: str):
+    """
+    Function to register a new job as queued, and forget jobs past their retention.
+
+    :param job_id: Id of the job, the run id of the sync
+    :param kind: What the job does, e.g. "events" or "tickets:123"
+    """
+
+    now = time.time()
+    with connection() as conn:
+        conn.execute("DELETE FROM jobs WHERE created < ?", (now - JOB_RETENTION_SECONDS,))
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, kind, status, created, updated) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, kind, now, now),
+        )
+
+
+def get(job_id: str) -> Optional[Dict]:
+    """
+    Function to return the state of a job, with its duration and rate computed.
+    """
+
+    with connection(readonly=True) as conn:
+        row = conn.execute(
+            f"""
+            SELECT {', '.join(f'j.{field}' for field in FIELDS)}, s.status, s.lease_expires
+            FROM jobs j LEFT JOIN sync_runs s ON s.run_id = j.job_id
+            WHERE j.job_id = ?
+        """,
+            (job_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(FIELDS, row[: len(FIELDS)], strict=True))
+    run_status, lease_expires = row[len(FIELDS) :]
+    if job["status"] in ("queued", "running") and (run_status != "running" or (lease_expires or 0) < time.time()):
+        # The worker running it stopped without finishing the job
+        job["status"] = "failed"
+        job["message"] = "The worker running this job stopped"
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    if job["started"] is not None:
+        job["seconds"] = round((job["finished"] or time.time()) - job["started"], 2)
+        job["per_second"] = round(job["processed"] / job["seconds"], 1) if job["seconds"] else None
+    return job
+
+
+def save(job_id: str, values: Dict):
+    values = dict(values, updated=time.time())
+    with connection() as conn:
+        conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in values)} WHERE job_id = ?",
+            (*values.values(), job_id),
+        )
+
+
+class Progress:
+    """
+    Progress of the job running in this task; flushed to the jobs table at most once
+    per JOB_UPDATE_INTERVAL.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.processed = 0
+        self.total: Optional[int] = None
+        self.errors = 0
+        self.message: Optional[str] = None
+        self._saved = 0.0
+
+    def values(self) -> Dict:
+        return {"processed": self.processed, "total": self.total, "errors": self.errors, "message": self.message}
+
+    async def flush(self, force: bool = False):
+        if force or time.monotonic() - self._saved >= JOB_UPDATE_INTERVAL:
+            self._saved = time.monotonic()
+            await asyncio.to_thread(save, self.job_id, self.values())
+
+
+async def progress(
+    processed: Optional[int] = None,
+    total: Optional[int] = None,
+    errors: Optional[int] = None,
+    message: Optional[str] = None,
+    advance: int = 0,
+):
+    """
+    Function to report progress of the current job. Does nothing outside a job, so
+    sync functions can also be called directly.
+
+    :param processed: Absolute number of processed items
+    :param total: Number of items the job will process, once known
+    :param errors: Absolute number of failed items
+    :param message: Short description of the current step
+    :param advance: Number of items processed since the last call
+    """
+
+    current = CURRENT_JOB.get()
+    if current is None:
+        return
+    if processed is not None:
+        current.processed = processed
+    current.processed += advance
+    if total is not None:
+        current.total = total
+    if errors is not None:
+        current.errors = errors
+    if message is not None:
+        current.message = message
+    await current.flush(force=total is not None or message is not None)
+
+
+async def run(job_id: str, work: Callable[[], Awaitable], kind: str = "job"):
+    """
+    Function to run a job, recording its start, progress, result and outcome.
+
+    :param job_id: Id of a job registered with create()
+    :param work: Coroutine function doing the work; a dict it returns is stored as result
+    :param kind: Kind of job for the job_duration_seconds metric, e.g. "tickets"
+    """
+
+    start = time.perf_counter()
+    current = Progress(job_id)
+    token = CURRENT_JOB.set(current)
+    await asyncio.to_thread(save, job_id, {"status": "running", "started": time.time()})
+    status = "failed"
+    result = None
+    try:
+        result = await work()
+        status = "finished"
+        return result
+    except Exception as exc:
+        current.message = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        CURRENT_JOB.reset(token)
+        metrics.JOB_SECONDS.observe(time.perf_counter() - start, kind=kind, status=status)
+        values = dict(current.values(), status=status, finished=time.time())
+        if isinstance(result, dict):
+            values["result"] = json.dumps(result)
+        await asyncio.to_thread(save, job_id, values)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+"""
+JSON encoding of responses and stored projections.
+
+Uses orjson when it is installed and the standard library otherwise. Both produce the
+same compact UTF-8 output, so bytes stored by one can be sent next to bytes produced by
+the other.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def join(items) -> bytes:
+    """
+    Function to assemble a JSON array from already encoded items.
+    """
+
+    return b"[" + b",".join(items) + b"]"
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Registry of kentekens (license plates) of participations.
+
+The registry reads KENTEKENS_FILE, either JSON ({"participation id": "plate"}) or CSV
+(participation id,plate per line), and keeps two indexes: participation id -> plate as
+displayed, and plate without separators -> participation ids, so a plate can be looked
+up however it was typed. The file is loaded on first use and reloaded when its mtime or
+size changes; every worker notices that by itself within KENTEKENS_CHECK_SECONDS.
+"""
+
+import csv
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from database import content_hash
+from logger import error, log, warning
+
+
+KENTEKENS_FILE = os.getenv("KENTEKENS_FILE", "/db/kenteken.json")
+KENTEKENS_CHECK_SECONDS = float(os.getenv("KENTEKENS_CHECK_SECONDS", "5"))
+
+SEPARATORS = re.compile(r"[^0-9A-Z]")
+# A dash between letters and digits: "VX77XJ" -> "VX-77-XJ"
+LETTER_DIGIT_BOUNDARY = re.compile(r"(?<=[A-Z])(?=[0-9])|(?<=[0-9])(?=[A-Z])")
+# Two groups of 2 and 4 (or 4 and 2) characters are three groups of 2: "12-ABCD" -> "12-AB-CD"
+TWO_FOUR = re.compile(r"^(\w{2})-(\w{2})(\w{2})$")
+FOUR_TWO = re.compile(r"^(\w{2})(\w{2})-(\w{2})$")
+
+
+def compact(plate: str) -> str:
+    """
+    Function to reduce a plate to its letters and digits, the key plates are looked up by.
+    """
+
+    return SEPARATORS.sub("", plate.upper())
+
+
+def normalize(plate: str) -> str:
+    """
+    Function to format a plate the way it is displayed, e.g. "vx77xj" -> "VX-77-XJ".
+    Plates that already contain dashes are only uppercased.
+    """
+
+    plate = plate.upper().replace(" ", "")
+    if "-" in plate:
+        return plate
+    plate = LETTER_DIGIT_BOUNDARY.sub("-", plate)
+    return FOUR_TWO.sub(r"\1-\2-\3", TWO_FOUR.sub(r"\1-\2-\3", plate))
+
+
+def read_entries(path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Function to read (participation id, plate) pairs from a JSON or CSV file; raises
+    ValueError when the file is not a mapping of ids to plates.
+    """
+
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if path.lower().endswith(".json"):
+            entries = json.load(file)
+            if not isinstance(entries, dict):
+                raise ValueError(f"expected an object of participation ids and plates, got {type(entries).__name__}")
+            for participation_id, plate in entries.items():
+                if not isinstance(plate, str) or not plate.strip():
+                    raise ValueError(f"invalid kenteken {plate!r} for participation {participation_id}")
+                yield participation_id, plate
+            return
+        for row in csv.reader(file):
+            if len(row) >= 2 and row[0].strip() and row[1].strip():
+                yield row[0].strip(), row[1]
+
+
+class Registry:
+    """
+    Hot-reloadable, two-way index of the kentekens in a file.
+    """
+
+    def __init__(self, path: str = KENTEKENS_FILE):
+        self.path = path
+        self.by_participation: Dict[str, str] = {}
+        self.by_plate: Dict[str, List[str]] = {}
+        self.version = content_hash({})
+        self._signature = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._signature is not None or self._checked is None:
+                warning("Kentekens file %s not found. Proceeding without kentekens.", self.path)
+            self._signature = None
+            self.by_participation, self.by_plate, self.version = {}, {}, content_hash({})
+            return
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        start = time.perf_counter()
+        by_participation = {}
+        by_plate: Dict[str, List[str]] = {}
+        try:
+            for participation_id, plate in read_entries(self.path):
+                by_participation[participation_id] = normalize(plate)
+                by_plate.setdefault(compact(plate), []).append(participation_id)
+        except Exception:
+            # Don't retry (and log) the same broken file until it changes again
+            self._signature = signature
+            raise
+        # Swap whole dicts, so readers never see a half-loaded registry
+        self.by_participation, self.by_plate = by_participation, by_plate
+        self.version = content_hash(by_participation)
+        self._signature = signature
+        log("Loaded %d kentekens from %s in %.3fs.", len(by_participation), self.path, time.perf_counter() - start)
+
+    def refresh(self) -> "Registry":
+        """
+        Function to reload the file when it changed, checked at most once per
+        KENTEKENS_CHECK_SECONDS.
+        """
+
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= KENTEKENS_CHECK_SECONDS:
+            with self._lock:
+                if self._checked is None or now - self._checked >= KENTEKENS_CHECK_SECONDS:
+                    try:
+                        self._load()
+                    except Exception as exc:
+                        # Keep serving the previous contents until the file is valid again
+                        error("Reading kentekens from %s failed: %s", self.path, exc)
+                    self._checked = now
+        return self
+
+    def plates(self) -> Dict[str, str]:
+        """
+        Function to return the plates by participation id.
+        """
+
+        return self.refresh().by_participation
+
+    def lookup(self, plate: str) -> List[str]:
+        """
+        Function to return the participation ids registered with a plate, in whatever
+        format the plate is given.
+        """
+
+        return self.refresh().by_plate.get(compact(plate), [])
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Logging helper shared by the modules of the app.
+
+log(), debug(), warning() and error() hand a record to a queue and return; a background
+thread formats it and writes it to stdout, so request handlers and sync loops never wait
+for the output. Records below LOG_LEVEL are dropped before anything is formatted. Pass
+the values as arguments (log("Fetched %d tickets", count)) rather than formatting them
+into the message, so skipped records cost nothing and sampled() can tell messages apart.
+
+Keyword arguments are logged as fields: appended as key=value in the default text format,
+or as keys of a JSON object per line with LOG_FORMAT=json.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "100")))
+
+_logger = logging.getLogger("congressus_app")
+_logger.setLevel(LOG_LEVEL)
+_logger.propagate = False
+
+_samples: Dict[str, itertools.count] = {}
+_samples_lock = threading.Lock()
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The format the app always had, "[2024-01-31 12:00:00] message", with the level for
+    anything but INFO and the fields at the end.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        level = "" if record.levelno == logging.INFO else f"{record.levelname} "
+        message = record.getMessage()
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))}] {level}{message}"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue stays in this process, so the record is passed on as is and
+        # formatted by the listener thread instead of the caller
+        return record
+
+
+def _start():
+    """
+    Function to start the thread writing queued records to stdout; also called in a
+    forked child, where the thread of the parent does not exist.
+    """
+
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    _logger.handlers = [DeferredQueueHandler(records)]
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+def flush():
+    """
+    Function to write out all queued records and stop the writing thread, at exit.
+    """
+
+    if _listener._thread is not None:
+        _listener.stop()
+
+
+_listener: logging.handlers.QueueListener
+_start()
+atexit.register(flush)
+os.register_at_fork(after_in_child=_start)
+
+
+def log(message: str = "", *args, level: int = logging.INFO, **fields):
+    """
+    Function to log a message.
+
+    :param message: Message, with %-style placeholders for args
+    :param level: logging level, INFO by default
+    :param fields: Structured fields logged with the message
+    """
+
+    if _logger.isEnabledFor(level):
+        _logger.log(level, message, *args, extra={"fields": fields})
+
+
+def debug(message: str, *args, **fields):
+    log(message, *args, level=logging.DEBUG, **fields)
+
+
+def warning(message: str, *args, **fields):
+    log(message, *args, level=logging.WARNING, **fields)
+
+
+def error(message: str, *args, **fields):
+    log(message, *args, level=logging.ERROR, **fields)
+
+
+def sampled(message: str, *args, level: int = logging.INFO, every: int = LOG_SAMPLE_EVERY, **fields):
+    """
+    Function to log only the first and then every n-th occurrence of a message that is
+    logged per item, e.g. per ticket of a sync. Occurrences are counted per message
+    template, so the values of args do not matter.
+
+    :param every: Log one in this many occurrences (LOG_SAMPLE_EVERY by default)
+    """
+
+    if not _logger.isEnabledFor(level):
+        return
+    with _samples_lock:
+        counter = _samples.setdefault(message, itertools.count())
+    occurrence = next(counter)
+    if occurrence % every == 0:
+        log(message, *args, level=level, occurrence=occurrence + 1, sampled=f"1/{every}", **fields)
@@ -22,19 +22,32 @@ GET /events
     Returns all events (cached unless refreshed)
 
 GET /events/refresh
-    Forces refresh and returns all events from Congressus API
+    Starts a refresh of all events from the Congressus API and returns its job
+
+GET /events/{event_id}/summary
+    Returns the ticket and presence counts of an event
 
 GET /event/{event_id}
     Returns details for a specific event
 
 GET /event/{event_id}/collect-tickets
-    Collects tickets for a specific event
+    Starts collecting the tickets of a specific event and returns its job
 
 GET /participations/{event_id}
     Returns participation details for an event (cached unless refreshed)
 
+GET /participations/{event_id}/stream
+    Streams every participation of an event that changes, as Server-Sent Events
+
 GET /participations/{event_id}/refresh
-    Forces refresh and returns participation details for an event
+    Starts a refresh of the participations of an event and returns its job
+
+GET /kenteken/{plate}
+    Returns the participations registered with a license plate
+
+GET /jobs/{job_id}
+    Returns the status, progress and timings of a background job started by one of the
+    refresh or collect endpoints
 
 GET /ticket/{event_id}/{obj_id}
     Returns ticket details for a specific ticket
@@ -42,28 +55,111 @@ GET /ticket/{event_id}/{obj_id}
 GET /ticket/{event_id}/{obj_id}/{new_status}
     Updates the status of a ticket and returns the result
 
+POST /event/{event_id}/check-in
+    Updates the status of up to 50 tickets of an event and returns the result per ticket
+
+GET /stats
+    Returns internal statistics: SQLite connection pool and Congressus API calls
+
+GET /metrics
+    Returns Prometheus metrics of all workers of the pod (text, not JSON)
+
+GET /healthz
+    Liveness probe, answers as soon as the worker runs
+
+GET /readyz
+    Readiness probe, 503 until the worker has migrated the database and warmed its caches
+
 All endpoints return JSON unless otherwise specified. Errors are returned with appropriate HTTP status codes and messages.
 """
 
+import asyncio
+import contextlib
+import functools
 import json
-import os
+import logging
 import sqlite3
 import time
-from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Tuple
 
 
-import httpx
 import fastapi
+import httpx
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.gzip import GZipMiddleware
+
+from congressus import CongressusClient
+import database
+import congressus
+import change_feed
+import jobs
+import json_codec
+import kentekens
+import metrics
+import response_cache
+import startup
+import static_assets
+import sync_coordinator
+import ticket_queue
+import versions
+from database import BulkWriter, add_column, connection, delta_sync, migrate
+from logger import debug, error, log, sampled, warning
 # from fastapi import Request
 # from fastapi.responses import StreamingResponse
 
 
-API_URL = "https://api.congressus.nl/v30"
 API_KEY_PATH = "api-key-2.txt"
-DB_PATH = os.getenv("CONGRESSUS_CACHE_DB", "/db/congressus_cache.db")
-PAGE_SIZE = 100
+# Fields of the event list and participation list, with the SQL selecting them; pick a
+# subset with ?fields= (see parse_fields)
+EVENT_STATS_FIELDS = {
+    "id": "CAST(event_id AS INTEGER)",
+    "name": "name",
+    "start": "start",
+    "leden_num_tickets": "leden_num_tickets",
+    "leden_sold_tickets": "leden_sold_tickets",
+    "niet_leden_num_tickets": "niet_leden_num_tickets",
+    "niet_leden_sold_tickets": "niet_leden_sold_tickets",
+    "present_leden": "present_leden",
+    "present_vrijrijders": "present_vrijrijders",
+}
+PARTICIPATION_FIELDS = {
+    "id": "CAST(p.participation_id AS INTEGER)",
+    "member_id": "p.member_id",
+    "status": "p.status",
+    "addressee": "p.addressee",
+    "email": "p.email",
+    "presence_count": "COALESCE(t.presence_count, 0)",
+    "tickets": "t.ticket_count",
+    # Not in the database, see kentekens.py
+    "kenteken": None,
+}
+# An upsert rather than INSERT OR REPLACE, so the change feed triggers see OLD and NEW
+TICKET_UPSERT = """
+    INSERT INTO tickets (
+        obj_id, event_id, data, last_updated, presence_count, ticket_count, status_presence, public_json
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(obj_id) DO UPDATE SET
+        event_id = excluded.event_id,
+        data = excluded.data,
+        last_updated = excluded.last_updated,
+        presence_count = excluded.presence_count,
+        ticket_count = excluded.ticket_count,
+        status_presence = excluded.status_presence,
+        public_json = excluded.public_json
+"""
+# Typed columns stored next to the JSON blobs, filled by delta_sync()
+EVENT_COLUMNS = {
+    "start": lambda event: event.get("start"),
+    "published": lambda event: 0 if event.get("published") is False else 1,
+}
+PARTICIPATION_COLUMNS = {
+    "status": lambda participation: participation.get("status"),
+    "member_id": lambda participation: participation.get("member_id"),
+    "addressee": lambda participation: participation.get("addressee"),
+    "email": lambda participation: participation.get("email"),
+    "public_json": lambda participation: json_codec.dumps(participation_public(participation)),
+}
 
 # Get current working directory of the script
 WORKING_DIRECTORY = __file__.rsplit("/", 1)[0]
@@ -71,102 +167,245 @@ WORKING_DIRECTORY = __file__.rsplit("/", 1)[0]
 # Get scriptname
 SCRIPT_NAME = __file__.rsplit("/", 1)[-1].split(".")[0]
 
-KENTEKENS_FILE = os.getenv("KENTEKENS_FILE", f"/db/kenteken.json")
-api_access_key = open(f"{WORKING_DIRECTORY}/{API_KEY_PATH}").read().strip()
-headers = {"Authorization": f"Bearer {api_access_key}"}
 
-app = fastapi.FastAPI()
+def read_api_key() -> str:
+    with open(f"{WORKING_DIRECTORY}/{API_KEY_PATH}") as file:
+        return file.read().strip()
+
+
+CONGRESSUS = CongressusClient(read_api_key)
+RESPONSE_CACHE = response_cache.ResponseCache()
+STARTUP = startup.Startup()
+STATIC_ASSETS = static_assets.StaticAssets()
+BULK_CHECK_IN_LIMIT = 50
+PARTICIPATION_PAGE_LIMIT = 1000
+NDJSON_BATCH_SIZE = 500
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    # Migrations have to be done before any request is served; the rest warms up in the
+    # background while /readyz keeps the worker out of the service
+    with STARTUP.phase("database"):
+        await run_in_threadpool(init_db)
+    background = [
+        asyncio.create_task(ticket_queue.run(process_ticket_queue_item)),
+        asyncio.create_task(metrics.run(connection)),
+        asyncio.create_task(warm_up()),
+    ]
+    yield
+    for task in background:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await CONGRESSUS.aclose()
+    database.POOL.close_all()
+
+
+app = fastapi.FastAPI(lifespan=lifespan)
 app.add_middleware(GZipMiddleware, minimum_size=1000)
-HTTP_CLIENT = httpx.Client(headers=headers, timeout=10)
-
-# Read kentekens.json if exists
-if os.path.exists(KENTEKENS_FILE):
-    with open(KENTEKENS_FILE, "r", encoding="utf-8") as f:
-        kentekens = json.load(f)
-else:
-    print(f"Kentekens file {KENTEKENS_FILE} not found. Proceeding without kentekens.")
-    kentekens = {}
-
-for kenteken_entry in kentekens.keys():
-    kenteken = kentekens[kenteken_entry].upper().replace(" ", "")
-    if '-' not in kenteken:
-        # Spit kenteken when changeing from letters to digits
-        new_kenteken = ""
-        for i in range(len(kenteken)):
-            if i > 0 and kenteken[i].isalpha() != kenteken[i-1].isalpha():
-                new_kenteken += '-'
-            new_kenteken += kenteken[i]
-        kenteken = new_kenteken
-        if len(kenteken) == 7 and kenteken.count('-') == 1:
-            kenteken_split = kenteken.split('-')
-            if (len(kenteken_split[0]) == 2 and len(kenteken_split[1]) == 4):
-                kenteken_split[1] = kenteken_split[1][:2] + '-' + kenteken_split[1][2:]
-            elif (len(kenteken_split[0]) == 4 and len(kenteken_split[1]) == 2):
-                kenteken_split[0] = kenteken_split[0][:2] + '-' + kenteken_split[0][2:]
-            kenteken = kenteken_split[0] + '-' + kenteken_split[1]
-    kentekens[kenteken_entry] = kenteken
-print(f"Loaded {len(kentekens)} kentekens from {KENTEKENS_FILE}")
-print(json.dumps(kentekens, indent=2))
+app.add_middleware(metrics.Middleware)
 
-def init_db():
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
-        cursor = conn.cursor()
-        # Enable WAL mode for better concurrency and performance
-        cursor.execute("PRAGMA journal_mode=WAL;")
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS events (
-                event_id TEXT PRIMARY KEY,
-                data TEXT,
-                last_updated TEXT
-            )
+KENTEKENS = kentekens.Registry()
+
+def create_tables(cursor: sqlite3.Cursor):
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS events (
+            event_id TEXT PRIMARY KEY,
+            data TEXT,
+            last_updated TEXT
         )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS participations (
+            participation_id TEXT PRIMARY KEY,
+            event_id TEXT,
+            data TEXT,
+            last_updated TEXT
+        )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_participations_event_id ON participations(event_id)")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            obj_id TEXT PRIMARY KEY,
+            event_id TEXT,
+            data TEXT,
+            last_updated TEXT
+        )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_event_id ON tickets(event_id)")
+
+
+def add_ticket_summary_columns(cursor: sqlite3.Cursor):
+    # Summary columns so the participation view can join on them instead of decoding tickets
+    add_column(cursor, "tickets", "presence_count", "INTEGER")
+    add_column(cursor, "tickets", "ticket_count", "INTEGER")
+    cursor.execute("SELECT obj_id, data FROM tickets WHERE presence_count IS NULL")
+    for obj_id, data in cursor.fetchall():
+        ticket = json.loads(data)
         cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS participations (
-                participation_id TEXT PRIMARY KEY,
-                event_id TEXT,
-                data TEXT,
-                last_updated TEXT
-            )
+            "UPDATE tickets SET presence_count = ?, ticket_count = ? WHERE obj_id = ?",
+            (count_presence(ticket), len(ticket.get("tickets", [])), obj_id),
+        )
+
+
+def add_content_hashes(cursor: sqlite3.Cursor):
+    # Content hashes used by delta_sync() to skip rows that did not change
+    add_column(cursor, "events", "content_hash", "TEXT")
+    add_column(cursor, "participations", "content_hash", "TEXT")
+
+
+def create_event_stats(cursor: sqlite3.Cursor):
+    # Per-event aggregates, maintained by the write paths so GET /events is a single read
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS event_stats (
+            event_id TEXT PRIMARY KEY,
+            name TEXT,
+            start TEXT,
+            published INTEGER,
+            leden_num_tickets INTEGER,
+            leden_sold_tickets INTEGER,
+            niet_leden_num_tickets INTEGER,
+            niet_leden_sold_tickets INTEGER,
+            present_leden INTEGER,
+            present_vrijrijders INTEGER,
+            last_updated TEXT
         )
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_participations_event_id ON participations(event_id)")
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_event_stats_published_start ON event_stats(published, start)")
+
+
+def add_typed_columns(cursor: sqlite3.Cursor):
+    # Promote the fields we filter on out of the JSON blobs into typed, indexed columns
+    add_column(cursor, "events", "start", "TEXT")
+    add_column(cursor, "events", "published", "INTEGER")
+    add_column(cursor, "participations", "status", "TEXT")
+    add_column(cursor, "participations", "member_id", "INTEGER")
+    add_column(cursor, "participations", "addressee", "TEXT")
+    add_column(cursor, "participations", "email", "TEXT")
+    add_column(cursor, "tickets", "status_presence", "TEXT")
+    cursor.execute(
+        """
+        UPDATE events SET
+            start = json_extract(data, '$.start'),
+            published = CASE WHEN json_extract(data, '$.published') = 0 THEN 0 ELSE 1 END
+    """
+    )
+    cursor.execute(
+        """
+        UPDATE participations SET
+            status = json_extract(data, '$.status'),
+            member_id = json_extract(data, '$.member_id'),
+            addressee = json_extract(data, '$.addressee'),
+            email = json_extract(data, '$.email')
+    """
+    )
+    cursor.execute("SELECT obj_id, data FROM tickets")
+    for obj_id, data in cursor.fetchall():
         cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tickets (
-                obj_id TEXT PRIMARY KEY,
-                event_id TEXT,
-                data TEXT,
-                last_updated TEXT
-            )
+            "UPDATE tickets SET status_presence = ? WHERE obj_id = ?",
+            (ticket_status_presence(json.loads(data)), obj_id),
+        )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_start ON events(published, start)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_participations_event_status ON participations(event_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_participations_member_id ON participations(member_id)")
+
+
+def add_public_json(cursor: sqlite3.Cursor):
+    # The serialized public projection of every participation and ticket, written next to
+    # the JSON blob, so reads can send it without decoding and encoding the blob
+    add_column(cursor, "participations", "public_json", "BLOB")
+    add_column(cursor, "tickets", "public_json", "BLOB")
+    cursor.execute(
         """
+        UPDATE participations SET public_json = CAST(json_object(
+            'id', CAST(participation_id AS INTEGER), 'member_id', member_id, 'status', status,
+            'addressee', addressee, 'email', email
+        ) AS BLOB)
+    """
+    )
+    cursor.execute("SELECT obj_id, data FROM tickets")
+    for obj_id, data in cursor.fetchall():
+        cursor.execute(
+            "UPDATE tickets SET public_json = ? WHERE obj_id = ?",
+            (json_codec.dumps(filter_tickets(json.loads(data))), obj_id),
         )
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_event_id ON tickets(event_id)")
-        conn.commit()
 
-# Initialize DB on startup
-init_db()
 
-# Expose via FastAPI
-@app.get("/")
-# ... (rest of the code) ...
+def index_participations_by_event(cursor: sqlite3.Cursor):
+    # Keyset pagination walks the participations of an event in participation_id order;
+    # this index also serves every lookup by event_id alone
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_participations_event_participation
+        ON participations(event_id, participation_id)
+    """
+    )
+    cursor.execute("DROP INDEX IF EXISTS idx_participations_event_id")
+
+
+# Schema migrations, applied in order by init_db(). Never change a released migration;
+# add a new one instead.
+MIGRATIONS = [
+    (1, create_tables),
+    (2, add_ticket_summary_columns),
+    (3, add_content_hashes),
+    (4, create_event_stats),
+    (5, add_typed_columns),
+    (6, sync_coordinator.create_table),
+    (7, jobs.create_table),
+    (8, change_feed.create_table),
+    (9, versions.create_table),
+    (10, ticket_queue.create_table),
+    (11, index_participations_by_event),
+    (12, add_public_json),
+    (13, metrics.create_table),
+    (14, metrics.create_retired_table),
+]
 
-# In get_events:
-# Remove CREATE TABLE
 
-# In get_participations:
-# Remove CREATE TABLE
+def init_db():
+    version = migrate(MIGRATIONS)
+    log("Database schema at version %s.", version)
+    with connection() as conn:
+        cursor = conn.cursor()
+        # Backfill stats for events cached before the event_stats table existed
+        cursor.execute("SELECT event_id FROM events WHERE event_id NOT IN (SELECT event_id FROM event_stats)")
+        missing_event_ids = [row[0] for row in cursor.fetchall()]
+        if missing_event_ids:
+            update_event_stats(cursor, missing_event_ids)
 
-# In get_ticket:
-# Remove CREATE TABLE
 
-# In functions using httpx.get or httpx.post, use HTTP_CLIENT.get/post without passing headers/timeout repeatedly if they are standard. 
-# But wait, some requests might need different params.
-# HTTP_CLIENT has base headers.
+async def warm_up():
+    """
+    Function to load what the first requests need, and mark the worker ready when done.
+    """
+
+    try:
+        with STARTUP.phase("kentekens"):
+            await run_in_threadpool(KENTEKENS.refresh)
+        with STARTUP.phase("static_assets"):
+            await run_in_threadpool(STATIC_ASSETS.load)
+        with STARTUP.phase("events"):
+            # Reads the event list once, so its pages are in the page cache
+            await run_in_threadpool(get_events)
+        with STARTUP.phase("api_key"):
+            await run_in_threadpool(CONGRESSUS.headers)
+    except Exception as exc:
+        error("Warming up failed, worker stays unready: %s", exc)
+        return
+    STARTUP.mark_ready()
 
 
+# Expose via FastAPI
 @app.get("/")
 async def root() -> fastapi.responses.RedirectResponse:
     """
@@ -186,179 +425,454 @@ async def html_root() -> fastapi.responses.RedirectResponse:
 
 
 @app.get("/html/{page_name}")
-async def html_page(page_name: str) -> fastapi.responses.HTMLResponse:
+async def html_page(page_name: str, request: fastapi.Request) -> fastapi.Response:
     """
-    Function to serve HTML pages from the html/ directory.
+    Function to serve the pages, scripts and stylesheets in the html/ directory.
 
-    :param page_name: Description
-    :type page_name: str
+    :param page_name: File name, plain or fingerprinted (see static_assets.py)
     """
 
-    if page_name == "":
-        page_name = "index.html"
-    file_path = f"html/{page_name}"
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as file:
-            content = file.read()
-        return fastapi.responses.HTMLResponse(status_code=200, content=content)
-    return fastapi.responses.Response(status_code=404, content="Page not found")
+    response = STATIC_ASSETS.response(request, page_name or "index.html")
+    if response is None:
+        return fastapi.responses.Response(status_code=404, content="Page not found")
+    return response
+
+
+@app.get("/healthz")
+async def read_health():
+    # Liveness only: no database or Congressus calls, and no log line per probe
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def read_readiness():
+    report = STARTUP.report()
+    return fastapi.responses.JSONResponse(status_code=200 if STARTUP.ready else 503, content=report)
+
+
+@app.get("/metrics")
+async def read_metrics():
+    # Scraped every few seconds, so not logged
+    text = await run_in_threadpool(metrics.collect, connection)
+    return fastapi.Response(content=text, media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/stats")
+def read_stats():
+    debug("Handling GET /stats")
+    return {
+        "database": database.POOL.stats(),
+        "congressus": congressus.stats(),
+        "streams": PARTICIPATION_FEED.stats(),
+        "response_cache": RESPONSE_CACHE.stats(),
+        "ticket_queue": ticket_queue.stats(),
+        "startup": STARTUP.report(),
+    }
+
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise fastapi.HTTPException(status_code=404, detail="Job not found")
+    return job
+
 
 @app.get("/events")
-def read_events():
-    log("Handling GET /events")
-    return get_events(force_refresh=False)
+async def read_events(request: fastapi.Request, fields: Optional[str] = None):
+    debug("Handling GET /events")
+    selected = parse_fields(fields, EVENT_STATS_FIELDS)
+    return await versioned_response(request, "events", functools.partial(load_events, selected))
+
+
+@app.get("/events/{event_id}/summary")
+async def read_event_summary(event_id: str, request: fastapi.Request, fields: Optional[str] = None):
+    debug("Handling GET /events/%s/summary", event_id)
+    selected = parse_fields(fields, EVENT_STATS_FIELDS)
+    return await versioned_response(
+        request, f"event:{event_id}", functools.partial(run_in_threadpool, get_event_summary, event_id, selected)
+    )
 
 
 @app.get("/events/refresh")
-def refresh_events(background_tasks: fastapi.BackgroundTasks):
-    log("Handling GET /events/refresh (Background)")
-    background_tasks.add_task(get_events, force_refresh=True)
-    return {"status": "accepted", "message": "Event refresh started in background"}
+def refresh_events_endpoint(background_tasks: fastapi.BackgroundTasks):
+    debug("Handling GET /events/refresh (Background)")
+    return start_sync(background_tasks, "events", refresh_events, "Event refresh started in background")
 
 
 @app.get("/event/{event_id}")
 def read_event(event_id: str):
-    log(f"Handling GET /event/{event_id}")
+    debug("Handling GET /event/%s", event_id)
     return get_event(event_id)
 
 
 @app.get("/event/{event_id}/collect-tickets")
 def collect_tickets(event_id: str, background_tasks: fastapi.BackgroundTasks):
-    log(f"Handling GET /event/{event_id}/collect-tickets (Background)")
-    background_tasks.add_task(collect_tickets_for_event, event_id)
-    return {"status": "accepted", "message": "Ticket collection started in background"}
+    debug("Handling GET /event/%s/collect-tickets (Background)", event_id)
+    return start_sync(
+        background_tasks,
+        f"tickets:{event_id}",
+        functools.partial(collect_tickets_for_event, event_id),
+        "Ticket collection started in background",
+    )
 
 
 @app.get("/participations/{event_id}")
-def read_participations(event_id: str):
-    log(f"Handling GET /participations/{event_id}")
-    return get_participations(event_id, force_refresh=False)
+async def read_participations(
+    event_id: str,
+    request: fastapi.Request,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    response_format: str = fastapi.Query("json", alias="format"),
+):
+    """
+    Function to list the participations of an event: all at once, a page of limit
+    rows after cursor, or streamed as NDJSON with ?format=ndjson.
+    """
+
+    debug("Handling GET /participations/%s", event_id)
+    selected = parse_fields(fields, PARTICIPATION_FIELDS)
+    scope = f"event:{event_id}"
+    extra = (await run_in_threadpool(KENTEKENS.refresh)).version
+    if response_format == "ndjson":
+        await ensure_participations(event_id)
+        etag = await run_in_threadpool(versions.etag, request, scope, extra)
+        if (not_modified := versions.not_modified(request, etag)) is not None:
+            return not_modified
+        return fastapi.responses.StreamingResponse(
+            stream_participation_lines(event_id, selected),
+            media_type="application/x-ndjson",
+            headers=versions.headers(etag),
+        )
+    if response_format != "json":
+        raise fastapi.HTTPException(status_code=400, detail='format must be "json" or "ndjson".')
+    if limit is None and cursor is None:
+        return await versioned_response(
+            request, scope, functools.partial(load_participations, event_id, selected), extra=extra
+        )
+    if limit is None:
+        limit = PARTICIPATION_PAGE_LIMIT
+    if not 1 <= limit <= PARTICIPATION_PAGE_LIMIT:
+        raise fastapi.HTTPException(status_code=400, detail=f"limit must be between 1 and {PARTICIPATION_PAGE_LIMIT}.")
+    return await versioned_response(
+        request, scope, functools.partial(load_participation_page, event_id, selected, cursor, limit), extra=extra
+    )
+
+
+@app.get("/participations/{event_id}/stream")
+async def stream_participations(event_id: str, request: fastapi.Request):
+    """
+    Function to push changed participations of an event as Server-Sent Events, in the
+    format of GET /participations/{event_id}. Deleted participations are sent as
+    {"id": ..., "deleted": true}; a "reload" event asks the client to fetch the list.
+    """
+
+    debug("Handling GET /participations/%s/stream", event_id)
+    return fastapi.responses.StreamingResponse(
+        PARTICIPATION_FEED.stream(event_id, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/participations/{event_id}/refresh")
-def refresh_participations(event_id: str, background_tasks: fastapi.BackgroundTasks):
-    log(f"Handling GET /participations/{event_id}/refresh (Background)")
-    background_tasks.add_task(get_participations, event_id, force_refresh=True)
-    return {"status": "accepted", "message": "Participation refresh started in background"}
+def refresh_participations_endpoint(event_id: str, background_tasks: fastapi.BackgroundTasks):
+    debug("Handling GET /participations/%s/refresh (Background)", event_id)
+    return start_sync(
+        background_tasks,
+        f"participations:{event_id}",
+        functools.partial(refresh_participations, event_id),
+        "Participation refresh started in background",
+    )
+
+
+@app.get("/kenteken/{plate}")
+def read_kenteken(plate: str, event_id: Optional[str] = None):
+    debug("Handling GET /kenteken/%s", plate)
+    participation_ids = KENTEKENS.lookup(plate)
+    if not participation_ids:
+        raise fastapi.HTTPException(status_code=404, detail="Kenteken not found")
+    return {
+        "kenteken": kentekens.normalize(plate),
+        "participations": find_participations(participation_ids, event_id),
+    }
 
 
 @app.get("/ticket/{event_id}/{obj_id}")
-def read_ticket(event_id: str, obj_id: str):
-    log(f"Handling GET /ticket/{event_id}/{obj_id}")
-    return get_ticket(event_id, obj_id)
+async def read_ticket(event_id: str, obj_id: str, request: fastapi.Request):
+    debug("Handling GET /ticket/%s/%s", event_id, obj_id)
+    # Not cached: there are many tickets, each fetched by one device at a time
+    return await versioned_response(
+        request, f"event:{event_id}", functools.partial(get_ticket, event_id, obj_id), cache=False
+    )
+
+
+@app.post("/event/{event_id}/check-in")
+async def bulk_update_tickets(event_id: str, changes: Annotated[List[Dict], fastapi.Body()]):
+    """
+    Function to change the presence of several participations at once.
+    The body is a list of {"obj_id": ..., "status": ...}.
+    """
+
+    debug("Handling POST /event/%s/check-in (%s changes)", event_id, len(changes))
+    if not changes or len(changes) > BULK_CHECK_IN_LIMIT:
+        raise fastapi.HTTPException(status_code=400, detail=f"Send 1 to {BULK_CHECK_IN_LIMIT} changes.")
+    if any(not isinstance(change, dict) or "obj_id" not in change or "status" not in change for change in changes):
+        raise fastapi.HTTPException(status_code=400, detail='Every change needs an "obj_id" and a "status".')
+    return await do_bulk_update_tickets(event_id, changes)
 
 
 @app.get("/ticket/{event_id}/{obj_id}/{new_status}")
-def update_ticket(event_id: str, obj_id: str, new_status: str):
-    log(f"Handling GET /ticket/{event_id}/{obj_id}/{new_status}")
-    return do_update_ticket(event_id, obj_id, new_status)
+async def update_ticket(event_id: str, obj_id: str, new_status: str):
+    debug("Handling GET /ticket/%s/%s/%s", event_id, obj_id, new_status)
+    return await do_update_ticket(event_id, obj_id, new_status)
+
+
+def parse_fields(fields: Optional[str], available: Dict[str, Optional[str]]) -> List[str]:
+    """
+    Function to parse the ?fields= projection of a list endpoint.
+
+    :param fields: Comma-separated field names, or None for all fields
+    :param available: Fields the endpoint has, in their default order
+    :return: The selected fields, in the requested order
+    """
+
+    if fields is None:
+        return list(available)
+    selected = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in selected if field not in available]
+    if not selected or unknown:
+        raise fastapi.HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown) or '(none given)'}. Available: {', '.join(available)}.",
+        )
+    return selected
+
+
+async def versioned_response(
+    request: fastapi.Request, scope: str, build, extra: str = "", cache: bool = True
+) -> fastapi.Response:
+    """
+    Function to answer a GET from the data in a version scope: 304 when the client has
+    the current version, the body cached by this worker when it was built for the
+    current version, and otherwise a freshly built body.
+
+    Building may sync missing data first, which changes the version. The body is only
+    tagged and cached with a version that did not change while it was built, so it is
+    built once more when it did; a body that still raced a write is sent untagged.
+
+    :param request: Request being answered
+    :param scope: Data version scope of the response, e.g. "events" or "event:123"
+    :param build: Coroutine function returning the response data, or its JSON encoding
+    :param extra: Version of data in the response that is not in the database
+    :param cache: Keep the body in RESPONSE_CACHE
+    """
+
+    etag = await run_in_threadpool(versions.etag, request, scope, extra)
+    if (not_modified := versions.not_modified(request, etag)) is not None:
+        return not_modified
+    key = f"{request.url.path}?{request.url.query}"
+    body = RESPONSE_CACHE.get(key, etag) if cache else None
+    if body is None:
+        for _ in range(2):
+            data = await build()
+            # Builders may return the body already encoded
+            body = data if isinstance(data, bytes) else json_codec.dumps(data)
+            built_etag, etag = etag, await run_in_threadpool(versions.etag, request, scope, extra)
+            if etag == built_etag:
+                break
+        else:
+            return fastapi.Response(content=body, media_type="application/json", headers=dict(versions.HEADERS))
+        if cache:
+            RESPONSE_CACHE.put(key, etag, body)
+    return fastapi.Response(content=body, media_type="application/json", headers=versions.headers(etag))
+
+
+def start_sync(background_tasks: fastapi.BackgroundTasks, sync_key: str, sync, message: str) -> Dict:
+    """
+    Function to start a sync in the background, unless the same sync is already
+    running in one of the workers or has just finished. In that case the request
+    is attached to that run. Either way the response holds the id of the job to
+    poll at /jobs/{job_id}.
+
+    :param background_tasks: Background tasks of the request
+    :param sync_key: Name of the sync, e.g. "events" or "participations:123"
+    :param sync: Coroutine function performing the sync
+    :param message: Message returned when the sync is started
+    """
+
+    run_id, started = sync_coordinator.claim(sync_key)
+    if started:
+        background_tasks.add_task(sync_coordinator.run, sync_key, run_id, sync)
+    else:
+        log("Sync %s already running or just finished, attaching to run %s.", sync_key, run_id)
+        message = "Attached to a sync that is running or has just finished"
+    return {
+        "status": "accepted",
+        "message": message,
+        "run_id": run_id,
+        "job_id": run_id,
+        "job_url": f"/jobs/{run_id}",
+        "attached": not started,
+    }
 
 
 def main():
-    all_events = get_events(force_refresh=False)
-    log(f"Total events fetched: {len(all_events)}")
+    init_db()
+    all_events = asyncio.run(load_events())
+    log("Total events fetched: %d", len(all_events))
+
+
+async def load_events(fields: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Function to return the cached events, syncing them from Congressus first
+    when the cache is still empty.
+
+    :param fields: Fields to return, see EVENT_STATS_FIELDS
+    """
+
+    if not await run_in_threadpool(has_events):
+        log("No existing events in DB. Forcing refresh.")
+        await sync_coordinator.single_flight("events", refresh_events)
+    return await run_in_threadpool(get_events, fields)
+
+
+async def refresh_events():
+    """
+    Function to sync all events from Congressus, followed by the participations
+    of every event. The participations of the events are fetched in parallel.
+    """
 
+    log("Fetching events from API...")
+    await jobs.progress(message="Fetching events")
+    events = await CONGRESSUS.get_paginated("/events")
+    log("Fetched %d events from API.", len(events))
+    await run_in_threadpool(store_events, events)
+    await refresh_participations_for_events([event["id"] for event in events])
 
-def get_events(force_refresh: bool = False):
 
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+async def refresh_participations_for_events(event_ids: List[str]):
+    # Fetch concurrently, but store one event at a time so the writes don't fight over the write lock
+    storing = asyncio.Lock()
+
+    async def sync(event_id):
+        participations = await fetch_participations(event_id)
+        async with storing:
+            await run_in_threadpool(store_participations, event_id, participations)
+
+    async def refresh(event_id):
+        # As its own single-flight sync, so a refresh of the event that is running meanwhile is attached to
+        try:
+            status = await sync_coordinator.single_flight(
+                f"participations:{event_id}", functools.partial(sync, event_id)
+            )
+        except Exception as exc:
+            return event_id, exc
+        return event_id, None if status == "finished" else RuntimeError(f"Sync {status}")
+
+    failed = 0
+    await jobs.progress(processed=0, total=len(event_ids), message="Refreshing participations")
+    for future in asyncio.as_completed([refresh(event_id) for event_id in event_ids]):
+        event_id, exc = await future
+        if exc is not None:
+            failed += 1
+            warning("Refreshing participations for event %s failed: %s", event_id, exc)
+            await jobs.progress(advance=1, errors=failed)
+            continue
+        await jobs.progress(advance=1)
+    log("Refreshed participations for %d/%d events.", len(event_ids) - failed, len(event_ids))
+
+
+async def refresh_participations(event_id: str):
+    await jobs.progress(message="Refreshing participations")
+    participations = await fetch_participations(event_id)
+    await run_in_threadpool(store_participations, event_id, participations)
+
+
+async def fetch_participations(event_id: str) -> List[Dict]:
+    debug("Fetching participations for event %s from API...", event_id)
+    participations = await CONGRESSUS.get_paginated(f"/events/{event_id}/participations")
+    debug("Fetched %d participations from API for event %s.", len(participations), event_id)
+    return participations
+
+
+def has_events() -> bool:
+    with connection(readonly=True) as conn:
+        row = conn.execute("SELECT 1 FROM events LIMIT 1").fetchone()
+    return row is not None
+
+
+def has_participations(event_id: str) -> bool:
+    with connection(readonly=True) as conn:
+        row = conn.execute(
+            "SELECT 1 FROM participations WHERE event_id = ? LIMIT 1", (event_id,)
+        ).fetchone()
+    return row is not None
+
+
+def store_events(events: List[Dict]):
+    with connection() as conn:
         cursor = conn.cursor()
+        debug("Storing events in DB...")
+        result = delta_sync(
+            cursor, "events", "event_id", {str(event["id"]): event for event in events}, columns=EVENT_COLUMNS
+        )
+        update_event_stats(cursor, result["changed_keys"])
+    log_sync_result("events", result)
+
+
+def log_sync_result(name: str, result: Dict, level: int = logging.INFO, **fields):
+    log(
+        "Synced %s: %d inserted, %d updated, %d deleted, %d unchanged.",
+        name,
+        result["inserted"],
+        result["updated"],
+        result["deleted"],
+        result["unchanged"],
+        level=level,
+        **fields,
+    )
+
 
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+def get_events(fields: Optional[List[str]] = None) -> List[Dict]:
+    fields = fields or list(EVENT_STATS_FIELDS)
+    with connection(readonly=True) as conn:
         cursor = conn.cursor()
-        
-        # Table creation moved to init_db
-
-        # fetch all events from sqlite
-        cursor.execute("SELECT event_id FROM events")
-        existing_event_ids = {row[0] for row in cursor.fetchall()}
-        if not existing_event_ids:
-            log("No existing events in DB. Forcing refresh.")
-            force_refresh = True
-
-        if force_refresh:
-            log("Fetching events from API...")
-            has_next = True
-            params = {"page_size": PAGE_SIZE, "page": 1}
-            url = f"{API_URL}/events"
-            events: List[Dict] = []
-
-            while has_next:
-                # Use global client
-                resp = HTTP_CLIENT.get(url, params=params)
-                resp.raise_for_status()
-
-                events += resp.json().get("data", [])
-                has_next = resp.json().get("has_next", False)
-                if has_next:
-                    params["page"] = resp.json().get("next_num", params["page"] + 1)
-
-            log(f"Fetched {len(events)} events from API.")
-            log("Storing events in DB...")
-
-            # Store events in the database
-            for event in events:
-                event_id = event["id"]
-                cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO events (event_id, data, last_updated)
-                    VALUES (?, ?, ?)
-                """,
-                    (event_id, json.dumps(event), time.strftime("%Y-%m-%d %H:%M:%S")),
-                )
-            conn.commit()
-            log("Events stored in DB.")
-
-            # Remove event IDs that are now in the database from existing_event_ids
-            removed_events = 0
-            for event_id in existing_event_ids:
-                if event_id in [str(event["id"]) for event in events]:
-                    continue
-                removed_events += 1
-                cursor.execute("DELETE FROM events WHERE event_id = ?", (event_id,))
-            conn.commit()
-            log(f"Removed {removed_events} obsolete events from DB.")
-            participations = get_participations(
-                [event["id"] for event in events], force_refresh=force_refresh
-            )
-            log(f"Participations: {json.dumps(participations)}")
-        else:
-            log("Loading events from DB...")
-            events = []
-
-            for row in cursor.execute("SELECT event_id, data FROM events"):
-                events.append(json.loads(row[1]))
-            log(f"Fetched {len(events)} events from DB.")
-
-            for index, event in enumerate(events):
-                start = event["start"]
-                # Check if date start is max 1 day in the future, current day, or in the past
-                log (start)
-                today = time.strftime("%Y-%m-%d")
-                start_dt = datetime.strptime(start, "%Y-%m-%dT%H:%M:%S")
-                today_dt = datetime.strptime(today, "%Y-%m-%d")
-                present_leden = 0
-                present_vrijrijders = 0
-                
-                # Fetch participations from DB to calculate presence counts for all events
-                participations = get_participations(event["id"], force_refresh=False)
-                for participation in participations:
-                    if participation.get("presence_count", 0) > 0:
-                        if participation.get("member_id") is not None:
-                            present_leden += 1
-                        else:
-                            present_vrijrijders += 1
-                
-                if start_dt <= today_dt + timedelta(days=1):
-                    log(f"Event {event['id']} is today or near. (Counts: L={present_leden}, V={present_vrijrijders})")
-                
-                events[index]["present_leden"] = present_leden
-                events[index]["present_vrijrijders"] = present_vrijrijders
-    return filter_events(events)
+        debug("Loading events from DB...")
+        cursor.execute(
+            f"""
+            SELECT {", ".join(EVENT_STATS_FIELDS[field] for field in fields)}
+            FROM event_stats WHERE published = 1 ORDER BY start
+        """
+        )
+        events = [dict(zip(fields, row, strict=True)) for row in cursor.fetchall()]
+        debug("Fetched %d events from DB.", len(events))
+    return events
+
+
+def get_event_summary(event_id: str, fields: Optional[List[str]] = None) -> Dict:
+    """
+    Function to return the counts of one event from event_stats, a single primary key
+    lookup however many events there are.
+
+    :param event_id: Event to summarize
+    :param fields: Fields to return, see EVENT_STATS_FIELDS
+    """
+
+    fields = fields or list(EVENT_STATS_FIELDS)
+    with connection(readonly=True) as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(EVENT_STATS_FIELDS[field] for field in fields)} FROM event_stats WHERE event_id = ?",
+            (event_id,),
+        ).fetchone()
+    if row is None:
+        raise fastapi.HTTPException(status_code=404, detail="Event not found")
+    return dict(zip(fields, row, strict=True))
 
 
 def get_event(event_id: str):
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+    with connection(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT data FROM events WHERE event_id = ?", (event_id,))
         row = cursor.fetchone()
@@ -367,222 +881,462 @@ def get_event(event_id: str):
     return {"error": "Event not found"}
 
 
-def filter_events(events_list: List[Dict]) -> List[Dict]:
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    cursor = conn.cursor()
-    return_events = []
-    for event in events_list:
-        if event["published"] is False:
+def filter_events(event: Dict) -> Dict:
+    """
+    Function to compute the ticket capacities for leden and niet-leden of an event
+    from its ticket types.
+
+    :param event: Event as returned by the Congressus API
+    """
+
+    leden_num_tickets = 0
+    niet_leden_num_tickets = 0
+    for tickets in event["ticket_types"]:
+        if tickets["price"] == 0 and tickets["num_tickets"] is not None:
+            leden_num_tickets += tickets.get("num_tickets", 0)
+        elif tickets["price"] > 39 and tickets["num_tickets"] is not None:
+            niet_leden_num_tickets += tickets.get("num_tickets", 0)
+    return {
+        "id": event["id"],
+        "name": event["name"],
+        "start": event["start"],
+        "leden_num_tickets": leden_num_tickets,
+        "niet_leden_num_tickets": niet_leden_num_tickets,
+    }
+
+
+def update_event_stats(cursor: sqlite3.Cursor, event_ids: List[str]):
+    """
+    Function to recompute the event_stats rows of the given events.
+    Called after events or participations of these events have been written.
+
+    :param cursor: Cursor of the connection holding the write transaction
+    :param event_ids: Ids of the events to recompute
+    """
+
+    for event_id in event_ids:
+        cursor.execute("SELECT data, published FROM events WHERE event_id = ?", (event_id,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("DELETE FROM event_stats WHERE event_id = ?", (event_id,))
             continue
-        leden_num_tickets = 0
-        leden_sold_tickets = 0
-        niet_leden_num_tickets = 0
-        niet_leden_sold_tickets = 0
-        log(f"Start: {event['start']}")
-        log(f"Ticket types for event {event['id']}: {event['name']}")
-        for tickets in event["ticket_types"]:
-            if tickets["price"] == 0 and tickets["num_tickets"] is not None:
-                leden_num_tickets += tickets.get("num_tickets", 0)
-            elif tickets["price"] > 39 and tickets["num_tickets"] is not None:
-                niet_leden_num_tickets += tickets.get("num_tickets", 0)
+        stats = filter_events(json.loads(row[0]))
+        published = row[1]
         cursor.execute(
-            "SELECT data FROM participations WHERE event_id = ?", (event["id"],)
-        )
-        participations = [json.loads(row[0]) for row in cursor.fetchall()]
-        if participations != "[]":
-            for participation in participations:
-                if participation["status"] != "approved":
-                    continue
-                if participation["member_id"] is not None:
-                    leden_sold_tickets += 1
-                elif participation["member_id"] is None:
-                    niet_leden_sold_tickets += 1
-        log(
-            f"Event {event['id']} - Leden: {leden_sold_tickets}/{leden_num_tickets}, Niet leden: {niet_leden_sold_tickets}/{niet_leden_num_tickets}"
+            """
+            SELECT
+                COALESCE(SUM(member_id IS NOT NULL), 0),
+                COALESCE(SUM(member_id IS NULL), 0)
+            FROM participations
+            WHERE event_id = ? AND status = 'approved'
+        """,
+            (event_id,),
         )
-        return_events.append(
-            {
-                "id": event["id"],
-                "name": event["name"],
-                "start": event["start"],
-                "leden_num_tickets": leden_num_tickets,
-                "leden_sold_tickets": leden_sold_tickets,
-                "niet_leden_num_tickets": niet_leden_num_tickets,
-                "niet_leden_sold_tickets": niet_leden_sold_tickets,
-                "present_leden": event.get("present_leden", 0),
-                "present_vrijrijders": event.get("present_vrijrijders", 0),
-            }
+        leden_sold_tickets, niet_leden_sold_tickets = cursor.fetchone()
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO event_stats (
+                event_id, name, start, published, leden_num_tickets, leden_sold_tickets,
+                niet_leden_num_tickets, niet_leden_sold_tickets, present_leden, present_vrijrijders,
+                last_updated
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0, ?)
+        """,
+            (
+                event_id,
+                stats["name"],
+                stats["start"],
+                published,
+                stats["leden_num_tickets"],
+                leden_sold_tickets,
+                stats["niet_leden_num_tickets"],
+                niet_leden_sold_tickets,
+                time.strftime("%Y-%m-%d %H:%M:%S"),
+            ),
         )
-    return return_events
+        refresh_event_presence(cursor, [event_id])
 
 
-def get_participations(event_id: int, force_refresh: bool = False):
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    cursor = conn.cursor()
+def adjust_event_presence(cursor: sqlite3.Cursor, event_id: str, participation_id: str, delta: int):
+    """
+    Function to move the present_leden/present_vrijrijders count of an event by delta
+    when a single ticket changes presence, without recomputing the whole event.
 
-    # Fetch all participations from sqlite
-    # Fetch all participations from sqlite
+    :param cursor: Cursor of the connection holding the write transaction
+    :param event_id: Id of the event
+    :param participation_id: Id of the participation whose presence changed
+    :param delta: +1 when the participation became present, -1 when it no longer is
+    """
 
     cursor.execute(
-        "SELECT participation_id, data, last_updated FROM participations WHERE event_id = ?",
-        (event_id,),
+        "SELECT member_id FROM participations WHERE participation_id = ?", (participation_id,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return
+    column = "present_leden" if row[0] is not None else "present_vrijrijders"
+    cursor.execute(
+        f"UPDATE event_stats SET {column} = MAX({column} + ?, 0) WHERE event_id = ?",
+        (delta, event_id),
     )
 
-    existing_participation_ids = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
-    if not existing_participation_ids:
-        log(f"No existing participations for event {event_id} in DB. Forcing refresh.")
-        force_refresh = True
 
-    if force_refresh:
-        log(f"Fetching participations for event {event_id} from API...")
+def refresh_event_presence(cursor: sqlite3.Cursor, event_ids: List[str]):
+    """
+    Function to recompute the present_leden/present_vrijrijders counts of the given
+    events in SQL. Used after a batch of ticket writes.
 
-        has_next = True
-        params = {"page_size": PAGE_SIZE, "page": 1}
-        url = f"{API_URL}/events/{event_id}/participations"
-        participations: List[Dict] = []
+    :param cursor: Cursor of the connection holding the write transaction
+    :param event_ids: Ids of the events to recompute
+    """
 
-        while has_next:
-            resp = HTTP_CLIENT.get(url, params=params)
-            resp.raise_for_status()
+    for event_id in event_ids:
+        cursor.execute(
+            """
+            SELECT
+                SUM(p.member_id IS NOT NULL),
+                SUM(p.member_id IS NULL)
+            FROM participations p
+            JOIN tickets t ON t.obj_id = p.participation_id AND t.event_id = p.event_id
+            WHERE p.event_id = ? AND t.presence_count > 0
+        """,
+            (event_id,),
+        )
+        present_leden, present_vrijrijders = cursor.fetchone()
+        cursor.execute(
+            "UPDATE event_stats SET present_leden = ?, present_vrijrijders = ? WHERE event_id = ?",
+            (present_leden or 0, present_vrijrijders or 0, event_id),
+        )
 
-            participations += resp.json().get("data", [])
-            has_next = resp.json().get("has_next", False)
-            if has_next:
-                params["page"] = resp.json().get("next_num", params["page"] + 1)
 
-        log(
-            f"Fetched {len(participations)} participations from API for event {event_id}."
-        )
-        log("Storing participations in DB...")
+def count_presence(ticket: Dict) -> int:
+    return sum(1 for t in ticket.get("tickets", []) if t.get("status_presence") == "present")
 
-        for participation in participations:
-            # Strip whitespace from all string values in participation dict
-            def strip_values(obj):
-                if isinstance(obj, dict):
-                    return {k: strip_values(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [strip_values(i) for i in obj]
-                elif isinstance(obj, str):
-                    return obj.strip()
-                else:
-                    return obj
 
-            participation = strip_values(participation)
-            participation_id = participation["id"]
-            cursor.execute(
-                """
-                INSERT OR REPLACE INTO participations (participation_id, event_id, data, last_updated)
-                VALUES (?, ?, ?, ?)
-            """,
-                (
-                    participation_id,
-                    event_id,
-                    json.dumps(participation),
-                    time.strftime("%Y-%m-%d %H:%M:%S"),
-                ),
-            )
-        conn.commit()
-        log("Participations stored in DB.")
-
-        # Remove participation IDs that are now in the database from existing_participation_ids
-        removed_participations = 0
-        for participation_id in existing_participation_ids:
-            if participation_id in [
-                str(participation["id"]) for participation in participations
-            ]:
-                continue
-            removed_participations += 1
-            cursor.execute(
-                "DELETE FROM participations WHERE participation_id = ?",
-                (participation_id,),
-            )
-        conn.commit()
-        log(f"Removed {removed_participations} obsolete participations from DB.")
+def ticket_status_presence(ticket: Dict):
+    """
+    Function to summarize the presence of all tickets of a participation:
+    the shared status_presence when all tickets agree, "partial" when they don't,
+    and None when there are no tickets.
+    """
+
+    statuses = {t.get("status_presence") for t in ticket.get("tickets", [])}
+    if not statuses:
+        return None
+    if len(statuses) == 1:
+        return statuses.pop()
+    return "partial"
+
+
+def strip_values(obj):
+    """
+    Function to strip whitespace from all string values in a (nested) API object.
+    """
+
+    if isinstance(obj, dict):
+        return {k: strip_values(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [strip_values(i) for i in obj]
+    elif isinstance(obj, str):
+        return obj.strip()
     else:
-        log(f"Loading participations for event {event_id} from DB...")
-        participations = []
-        for row in cursor.execute(
-            "SELECT participation_id, data, last_updated FROM participations WHERE event_id = ?",
-            (event_id,),
-        ):
-            participations.append(json.loads(row[1]))
-        log(f"Fetched {len(participations)} participations from DB for event {event_id}.")
+        return obj
 
-    try:
-        cursor.execute("SELECT data FROM tickets WHERE event_id = ?", (event_id,))
-    except sqlite3.OperationalError:
-        log("Tickets table does not exist yet.")
-        tickets = []
+
+def store_participations(event_id: str, participations: List[Dict]):
+    with connection() as conn:
+        cursor = conn.cursor()
+        debug("Storing participations in DB...")
+        records = {}
+        for participation in participations:
+            participation = strip_values(participation)
+            records[str(participation["id"])] = participation
+        result = delta_sync(
+            cursor,
+            "participations",
+            "participation_id",
+            records,
+            scope=("event_id", str(event_id)),
+            columns=PARTICIPATION_COLUMNS,
+        )
+        if result["changed_keys"]:
+            update_event_stats(cursor, [str(event_id)])
+    # One per event on a full refresh, which logs its own summary
+    log_sync_result("participations", result, level=logging.DEBUG, event_id=event_id)
+
+
+def participation_public(participation: Dict) -> Dict:
+    """
+    Function to select the fields of a participation that are listed in the overview,
+    stored serialized in participations.public_json.
+    """
+
+    return {field: participation.get(field) for field in ["id", "member_id", "status", "addressee", "email"]}
+
+
+def get_participations(
+    event_id: str,
+    participation_ids: Optional[List[str]] = None,
+    fields: Optional[List[str]] = None,
+    encoded: bool = False,
+) -> List:
+    """
+    Function to list the participations of an event as shown in the overview.
+
+    :param event_id: Event to list
+    :param participation_ids: Only list these participations (used by the change feed)
+    :param fields: Fields to return, see PARTICIPATION_FIELDS
+    :param encoded: Return every participation JSON encoded, see get_participation_page
+    """
+
+    debug("Loading participations for event %s from DB...", event_id)
+    participations, _ = get_participation_page(
+        event_id, fields, participation_ids=participation_ids, encoded=encoded
+    )
+    debug("Fetched %d participations from DB for event %s.", len(participations), event_id)
+    return participations
+
+
+def get_participation_page(
+    event_id: str,
+    fields: Optional[List[str]] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    participation_ids: Optional[List[str]] = None,
+    encoded: bool = False,
+) -> Tuple[List, Optional[str]]:
+    """
+    Function to read participations of an event in participation_id order, seeking
+    past the previous page in the (event_id, participation_id) index instead of
+    counting an offset.
+
+    :param event_id: Event to list
+    :param fields: Fields to return, see PARTICIPATION_FIELDS
+    :param after: participation_id of the last row of the previous page
+    :param limit: Maximum number of rows, or None for all of them
+    :param participation_ids: Only list these participations
+    :param encoded: Return the rows JSON encoded, assembled from the stored public_json
+        of the participation and its ticket summary; only for all fields
+    :return: The rows, and the participation_id of the last row
+    """
+
+    fields = fields or list(PARTICIPATION_FIELDS)
+    if encoded:
+        columns = ["public_json", "presence_count", "tickets"]
+        select = "p.public_json, COALESCE(t.presence_count, 0), t.ticket_count"
     else:
-        tickets = [json.loads(row[0]) for row in cursor.fetchall()]
-    log(f"Fetched {len(tickets)} tickets from DB for event {event_id}.")
-    for participation in participations:
-        participation_pressence = 0
-        participation_tickets = None
-        for ticket in tickets:
-            if ticket.get("id") == participation.get("id"):
-                participation_tickets = len(ticket.get("tickets", []))
-                for t in ticket.get("tickets", []):
-                    if t.get("status_presence") == "present":
-                        participation_pressence += 1
-        participation["presence_count"] = participation_pressence
-        participation["tickets"] = participation_tickets
-        participation["kenteken"] = kentekens.get(str(participation.get("id")), "")
-    conn.close()
-
-    # Filter fields to reduce payload size
-    filtered_participations = []
-    allowed_fields = ["id", "member_id", "status", "addressee", "email", "presence_count", "tickets", "kenteken"]
-    for p in participations:
-        filtered_participations.append({k: p.get(k) for k in allowed_fields})
-
-    return filtered_participations
-
-
-def get_ticket(event_id: str, obj_id: str, refresh: bool = False):
-    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        columns = ["id"] + [field for field in fields if field != "id" and PARTICIPATION_FIELDS[field]]
+        select = ", ".join(PARTICIPATION_FIELDS[column] for column in columns)
+    query = f"SELECT p.participation_id, {select} FROM participations p"
+    if {"presence_count", "tickets"} & set(columns):
+        query += " LEFT JOIN tickets t ON t.obj_id = p.participation_id AND t.event_id = p.event_id"
+    query += " WHERE p.event_id = ?"
+    params: List = [event_id]
+    if participation_ids is not None:
+        query += f" AND p.participation_id IN ({', '.join('?' for _ in participation_ids)})"
+        params += participation_ids
+    if after is not None:
+        query += " AND p.participation_id > ?"
+        params.append(after)
+    query += " ORDER BY p.participation_id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    plates = KENTEKENS.plates() if "kenteken" in fields else {}
+    participations = []
+    last = None
+    with connection(readonly=True) as conn:
+        for last, *row in conn.execute(query, params):
+            if encoded:
+                public_json, presence_count, tickets = row
+                summary = json_codec.dumps(
+                    {"presence_count": presence_count, "tickets": tickets, "kenteken": plates.get(last, "")}
+                )
+                # {"id":..,"email":..} and {"presence_count":..} make {"id":..,"email":..,"presence_count":..}
+                participations.append(public_json[:-1] + b"," + summary[1:])
+                continue
+            values = dict(zip(columns, row, strict=True))
+            values["kenteken"] = plates.get(last, "")
+            participations.append({field: values[field] for field in fields})
+    return participations, last
+
+
+async def stream_participation_lines(event_id: str, fields: List[str]) -> AsyncIterator[bytes]:
+    """
+    Function to generate the participations of an event as NDJSON, one page of
+    NDJSON_BATCH_SIZE rows at a time, so memory use does not grow with the event.
+    Every page is a separate short read, so a slow client holds no read transaction open.
+    """
+
+    encoded = fields == list(PARTICIPATION_FIELDS)
+    after = None
+    while True:
+        rows, after = await run_in_threadpool(
+            get_participation_page, event_id, fields, after, NDJSON_BATCH_SIZE, None, encoded
+        )
+        if rows:
+            yield b"".join((row if encoded else json_codec.dumps(row)) + b"\n" for row in rows)
+        if len(rows) < NDJSON_BATCH_SIZE:
+            return
+
+
+def find_participations(participation_ids: List[str], event_id: Optional[str] = None) -> List[Dict]:
+    """
+    Function to look up participations by id, across events, with their event and presence.
+
+    :param participation_ids: Participations to look up
+    :param event_id: Only return participations of this event
+    """
+
+    fields = ["id", "event_id", "event_name", "member_id", "status", "addressee", "presence_count", "tickets"]
+    query = f"""
+        SELECT CAST(p.participation_id AS INTEGER), p.event_id, s.name, p.member_id, p.status, p.addressee,
+               COALESCE(t.presence_count, 0), t.ticket_count
+        FROM participations p
+        LEFT JOIN event_stats s ON s.event_id = p.event_id
+        LEFT JOIN tickets t ON t.obj_id = p.participation_id AND t.event_id = p.event_id
+        WHERE p.participation_id IN ({', '.join('?' for _ in participation_ids)})
+    """
+    params = list(participation_ids)
+    if event_id is not None:
+        query += " AND p.event_id = ?"
+        params.append(event_id)
+    with connection(readonly=True) as conn:
+        return [dict(zip(fields, row, strict=True)) for row in conn.execute(query, params)]
+
+PARTICIPATION_FEED = change_feed.Broadcaster(get_participations)
+
+
+async def ensure_participations(event_id: str):
+    """
+    Function to sync the participations of an event from Congressus when there are
+    none cached yet.
+    """
+
+    if not await run_in_threadpool(has_participations, event_id):
+        log("No existing participations for event %s in DB. Forcing refresh.", event_id)
+        await sync_coordinator.single_flight(
+            f"participations:{event_id}", functools.partial(refresh_participations, event_id)
+        )
+
+
+async def load_participations(event_id: str, fields: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Function to return the cached participations of an event, syncing them from
+    Congressus first when there are none yet.
+
+    :param fields: Fields to return, see PARTICIPATION_FIELDS
+    """
+
+    await ensure_participations(event_id)
+    if fields is None or fields == list(PARTICIPATION_FIELDS):
+        return json_codec.join(await run_in_threadpool(get_participations, event_id, None, None, True))
+    return await run_in_threadpool(get_participations, event_id, None, fields)
+
+
+async def load_participation_page(event_id: str, fields: List[str], cursor: Optional[str], limit: int) -> bytes:
+    """
+    Function to return one page of the participations of an event.
+
+    :param cursor: next_cursor of the previous page, or None for the first page
+    """
+
+    await ensure_participations(event_id)
+    encoded = fields == list(PARTICIPATION_FIELDS)
+    rows, last = await run_in_threadpool(get_participation_page, event_id, fields, cursor, limit, None, encoded)
+    items = json_codec.join(rows if encoded else map(json_codec.dumps, rows))
+    next_cursor = json_codec.dumps(last if len(rows) == limit else None)
+    return b'{"participations":' + items + b',"next_cursor":' + next_cursor + b"}"
+
+
+async def get_ticket(event_id: str, obj_id: str, refresh: bool = False):
+    """
+    Function to return the public projection of a ticket: the stored JSON encoding
+    when the ticket is cached, and otherwise the ticket fetched from Congressus.
+    """
+
+    if not refresh:
+        public_json = await run_in_threadpool(load_ticket, event_id, obj_id)
+        if public_json is not None:
+            return public_json
+        debug("Object not found in DB, fetching from API...")
+    debug("Fetching object %s for event %s from API...", obj_id, event_id)
+    # https://api.congressus.nl/v30/events/{event_id}/participations/{obj_id}'
+    data = await CONGRESSUS.get(f"/events/{event_id}/participations/{obj_id}")
+    await run_in_threadpool(store_ticket, event_id, obj_id, data)
+    return filter_tickets(data)
+
+
+def load_tickets(event_id: str, obj_ids: List[str]) -> Dict[str, Dict]:
+    """
+    Function to load the cached tickets of several participations in one query.
+
+    :return: Ticket data by participation id, for the participations that are cached
+    """
+
+    with connection(readonly=True) as conn:
+        rows = conn.execute(
+            f"SELECT obj_id, data FROM tickets WHERE event_id = ? AND obj_id IN ({', '.join('?' for _ in obj_ids)})",
+            [event_id, *obj_ids],
+        ).fetchall()
+    return {obj_id: json.loads(data) for obj_id, data in rows}
+
+
+def load_ticket(event_id: str, obj_id: str) -> Optional[bytes]:
+    with connection(readonly=True) as conn:
         cursor = conn.cursor()
+        cursor.execute(
+            "SELECT public_json, last_updated FROM tickets WHERE obj_id = ? AND event_id = ?",
+            (obj_id, event_id),
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    debug("Object last updated at %s", row[1])
+    return row[0]
 
 
+def store_ticket(event_id: str, obj_id: str, data: Dict):
+    with connection() as conn:
+        cursor = conn.cursor()
         cursor.execute(
-            "SELECT data, last_updated FROM tickets WHERE obj_id = ? AND event_id = ?", (obj_id, event_id)
+            "SELECT presence_count FROM tickets WHERE obj_id = ? AND event_id = ?",
+            (obj_id, event_id),
         )
+        row = cursor.fetchone()
+        previous_presence = row[0] if row else 0
+
+        debug("Storing ticket in DB...")
+        cursor.execute(TICKET_UPSERT, ticket_row(event_id, obj_id, data))
+        was_present = (previous_presence or 0) > 0
+        is_present = count_presence(data) > 0
+        if was_present != is_present:
+            adjust_event_presence(cursor, event_id, obj_id, 1 if is_present else -1)
+
+
+def ticket_row(event_id: str, obj_id: str, data: Dict):
+    return (
+        obj_id,
+        event_id,
+        json.dumps(data),
+        time.strftime("%Y-%m-%d %H:%M:%S"),
+        count_presence(data),
+        len(data.get("tickets", [])),
+        ticket_status_presence(data),
+        json_codec.dumps(filter_tickets(data)),
+    )
 
-        # Test the number of rows returned
-        rows = cursor.fetchall()
-        log(f"Rows returned: {len(rows)}")
-        if len(rows) == 0:
-            log("Object not found in DB, fetching from API...")
-            refresh = True
-        else:
-            log("Object found in DB.")
-            data, last_updated = rows[0]
-            data = json.loads(data)
-            log(f"Object last updated at {last_updated}")
-        if refresh:
-            log(f"Fetching object {obj_id} for event {event_id} from API...")
-                
-            # https://api.congressus.nl/v30/events/{event_id}/participations/{obj_id}'
-            url = f"{API_URL}/events/{event_id}/participations/{obj_id}"
-            resp = HTTP_CLIENT.get(url)
-            resp.raise_for_status()
-
-            data = resp.json()
-            log("Storing ticket in DB...")
-            cursor.execute(
-                """
-                INSERT OR REPLACE INTO tickets (obj_id, event_id, data, last_updated)
-                VALUES (?, ?, ?, ?)
-            """,
-                (
-                    obj_id,
-                    event_id,
-                    json.dumps(data),
-                    time.strftime("%Y-%m-%d %H:%M:%S"),
-                ),
-            )
-            conn.commit()
-    return filter_tickets(data)
+
+def ticket_writer() -> BulkWriter:
+    """
+    Function to create a BulkWriter for ticket rows that keeps the presence counts
+    in event_stats up to date for every written batch.
+    """
+
+    return BulkWriter(
+        TICKET_UPSERT,
+        after_flush=lambda cursor, rows: refresh_event_presence(cursor, {row[1] for row in rows}),
+    )
 
 
 def filter_tickets(tickets_list: Dict) -> Dict:
@@ -610,86 +1364,276 @@ def filter_tickets(tickets_list: Dict) -> Dict:
     return return_list
 
 
-def do_update_ticket(event_id: str, obj_id: str, new_status: str):
-    log(f"New status: {new_status}")
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        SELECT data FROM tickets WHERE obj_id = ? AND event_id = ?
-    """,
-        (obj_id, event_id)
-    )
-
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
+async def do_update_ticket(event_id: str, obj_id: str, new_status: str):
+    debug("New status: %s", new_status)
+    json_data = (await run_in_threadpool(load_tickets, event_id, [obj_id])).get(obj_id)
+    if json_data is None:
         return {"status": "error", "message": f"Ticket {obj_id} not found."}
-    
-    json_data = json.loads(row[0])
+
     for ticket in json_data.get("tickets", []):
         if ticket["status_presence"] == new_status:
-            log(f"Ticket {ticket['id']} already has status_presence {new_status}. No update needed.")
+            debug("Ticket %s already has status_presence %s. No update needed.", ticket["id"], new_status)
             return {"status": "success", "message": f"Ticket {obj_id} already has status_presence {new_status}."}
-    
+
+    # A presence change that is still queued has to go first; queue this one after it
+    pending = await run_in_threadpool(ticket_queue.pending, "set-presence", event_id, [obj_id])
+    outcome = "queued" if pending else await send_presence(event_id, obj_id, new_status)
+    if outcome == "error":
+        return {"status": "error", "message": f"Failed to update ticket {obj_id}."}
+
+    # Answer from the local change; the queue re-fetches the ticket later to reconcile
+    await run_in_threadpool(apply_presence, event_id, obj_id, json_data, new_status, outcome == "queued")
+    return dict(filter_tickets(json_data), queued=outcome == "queued")
+
+
+async def do_bulk_update_tickets(event_id: str, changes: List[Dict]) -> List[Dict]:
+    """
+    Function to change the presence of several participations at once, e.g. a group
+    arriving together. The set-presence calls run concurrently (within the client's
+    rate limit), and the local updates are written in one transaction.
+
+    :param changes: {"obj_id": ..., "status": ...} per participation
+    :return: Result per change, in the order of the changes
+    """
+
+    obj_ids = list(dict.fromkeys(str(change["obj_id"]) for change in changes))
+    cached = await run_in_threadpool(load_tickets, event_id, obj_ids)
+    pending = await run_in_threadpool(ticket_queue.pending, "set-presence", event_id, obj_ids)
+
+    # The last change of a participation wins
+    wanted = {str(change["obj_id"]): change["status"] for change in changes}
+    results = {}
+    to_send = []
+    for obj_id, new_status in wanted.items():
+        data = cached.get(obj_id)
+        if data is None:
+            results[obj_id] = {"status": "error", "message": f"Ticket {obj_id} not found."}
+        elif any(ticket["status_presence"] == new_status for ticket in data.get("tickets", [])):
+            results[obj_id] = {"status": "unchanged"}
+        elif obj_id in pending:
+            results[obj_id] = {"status": "queued"}
+        else:
+            to_send.append(obj_id)
+
+    debug("Updating %d tickets of event %s in API...", len(to_send), event_id)
+    outcomes = await asyncio.gather(*(send_presence(event_id, obj_id, wanted[obj_id]) for obj_id in to_send))
+    for obj_id, outcome in zip(to_send, outcomes, strict=True):
+        if outcome == "error":
+            results[obj_id] = {"status": "error", "message": f"Failed to update ticket {obj_id}."}
+        else:
+            results[obj_id] = {"status": "success" if outcome == "sent" else "queued"}
+
+    applied = [
+        (obj_id, cached[obj_id], wanted[obj_id], result["status"] == "queued")
+        for obj_id, result in results.items()
+        if result["status"] in ("success", "queued")
+    ]
+    await run_in_threadpool(apply_presence_changes, event_id, applied)
+    for obj_id, data, _, _ in applied:
+        results[obj_id]["ticket"] = filter_tickets(data)
+    return [dict(results[str(change["obj_id"])], obj_id=str(change["obj_id"])) for change in changes]
+
+
+async def send_presence(event_id: str, obj_id: str, new_status: str) -> str:
+    """
+    Function to send a presence change to Congressus.
+
+    Gives up after CHECK_IN_TIMEOUT and CHECK_IN_MAX_RETRIES instead of the usual
+    retries with backoff, so a scan at the gate is answered quickly during an outage;
+    the ticket queue retries the change.
+
+    :return: "sent" when Congressus accepted it, "queued" when Congressus is unavailable
+        and the change has to be queued, "error" when it was rejected
+    """
+
     # https://api.congressus.nl/v30/events/{event_id}/participations/{obj_id}/set-presence
-    url = f"{API_URL}/events/{event_id}/participations/{obj_id}/set-presence"
-    log(f"Updating ticket {obj_id} to status_presence {new_status}...")
+    debug("Updating ticket %s to status_presence %s...", obj_id, new_status)
     payload = {"status_presence": new_status}
-    resp = HTTP_CLIENT.post(url, json=payload)
-    resp.raise_for_status()
-
-    conn.close()
+    try:
+        resp = await CONGRESSUS.post(
+            f"/events/{event_id}/participations/{obj_id}/set-presence",
+            payload,
+            timeout=congressus.CHECK_IN_TIMEOUT,
+            max_retries=congressus.CHECK_IN_MAX_RETRIES,
+        )
+    except httpx.HTTPStatusError as exc:
+        if not is_outage(exc):
+            warning("Failed to update ticket %s. Status code: %s", obj_id, exc.response.status_code)
+            return "error"
+        warning("Congressus unavailable, queueing status_presence %s for ticket %s.", new_status, obj_id)
+        return "queued"
+    except httpx.TransportError:
+        warning("Congressus unreachable, queueing status_presence %s for ticket %s.", new_status, obj_id)
+        return "queued"
     if resp.status_code != 204:
-        log(f"Failed to update ticket {obj_id}. Status code: {resp.status_code}")
-        return {"status": "error", "message": f"Failed to update ticket {obj_id}."}
-    
-    log(f"Ticket {obj_id} updated successfully in API. Updating local DB...")
-    return get_ticket(event_id, obj_id, refresh=True)
+        warning("Failed to update ticket %s. Status code: %s", obj_id, resp.status_code)
+        return "error"
+    debug("Ticket %s updated successfully in API. Updating local DB...", obj_id)
+    return "sent"
 
 
-def collect_tickets_for_event(event_id: str):
-    participations = get_participations(event_id, force_refresh=True)
-    log(f"Collected {len(participations)} participations for event {event_id}.")
+def is_outage(exc: httpx.HTTPStatusError) -> bool:
+    return exc.response.status_code == 429 or exc.response.status_code >= 500
 
-    import concurrent.futures
 
-    # Filter participations that need updating
-    to_update = []
-    for participation in participations:
-        if participation.get("status") != "approved":
-            continue
-        obj_id = participation["id"]
-        ticket_data = get_ticket(event_id, obj_id, refresh=False)
-        # Skip if already present
-        if ticket_data.get("tickets") is not None and len(ticket_data.get("tickets")) > 0 and ticket_data["tickets"][0].get("status_presence") is not None and ticket_data["tickets"][0]["status_presence"] == "present":
-            log(f"Ticket data for participation {obj_id} already exists and is present. Skipping refresh.")
-            continue
-        to_update.append(obj_id)
-
-    log(f"Found {len(to_update)} participations needing ticket update.")
-    
-    refreshed_count = 0
-    # Use ThreadPoolExecutor to fetch tickets concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_obj_id = {executor.submit(get_ticket, event_id, obj_id, refresh=True): obj_id for obj_id in to_update}
-        for future in concurrent.futures.as_completed(future_to_obj_id):
-            obj_id = future_to_obj_id[future]
-            try:
-                future.result()
-                refreshed_count += 1
-                if refreshed_count % 5 == 0:
-                    log(f"Progress: {refreshed_count}/{len(to_update)} updated.")
-            except Exception as exc:
-                log(f"Generated an exception for {obj_id}: {exc}")
-
-    log(f"Refreshed ticket data for {refreshed_count} participations for event {event_id}.")
-    return {"status": "success", "message": f"Collected tickets for event {event_id}."}
-
-
-def log(message: str = ""):
-    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}")
+def apply_presence_changes(event_id: str, changes: List[Tuple]):
+    """
+    Function to store several presence changes in one transaction.
+
+    :param changes: (obj_id, cached ticket data, new status, queued) per participation
+    """
+
+    with connection():
+        for obj_id, data, new_status, queued in changes:
+            apply_presence(event_id, obj_id, data, new_status, queued)
+
+
+def apply_presence(event_id: str, obj_id: str, data: Dict, new_status: str, queued: bool):
+    """
+    Function to store a presence change locally before Congressus confirmed it through
+    a re-fetch, together with the queued follow-up work.
+
+    :param data: Cached ticket data; updated in place
+    :param queued: The change itself still has to be sent to Congressus
+    """
+
+    for ticket in data.get("tickets", []):
+        ticket["status_presence"] = new_status
+    with connection() as conn:
+        store_ticket(event_id, obj_id, data)
+        cursor = conn.cursor()
+        if queued:
+            # The refresh is queued once the change went through
+            ticket_queue.enqueue(cursor, "set-presence", event_id, obj_id, {"status_presence": new_status})
+        else:
+            ticket_queue.enqueue(cursor, "refresh", event_id, obj_id, delay=ticket_queue.RECONCILE_DELAY_SECONDS)
+
+
+def queue_refresh(event_id: str, obj_id: str, delay: float):
+    with connection() as conn:
+        ticket_queue.enqueue(conn.cursor(), "refresh", event_id, obj_id, delay=delay)
+
+
+async def process_ticket_queue_item(item: Dict):
+    """
+    Function to handle one item of the ticket queue: send a queued presence change,
+    or re-fetch a ticket to correct the optimistic local state.
+    """
+
+    event_id, obj_id = item["event_id"], item["obj_id"]
+    path = f"/events/{event_id}/participations/{obj_id}"
+    if item["action"] == "set-presence":
+        try:
+            # The queue retries with backoff; long timeouts would hold up the rest of the batch
+            await CONGRESSUS.post(
+                f"{path}/set-presence",
+                item["payload"],
+                timeout=congressus.CHECK_IN_TIMEOUT,
+                max_retries=congressus.CHECK_IN_MAX_RETRIES,
+            )
+        except httpx.HTTPStatusError as exc:
+            if not is_outage(exc):
+                # Rejected for good; bring the local row back in line with Congressus
+                await run_in_threadpool(queue_refresh, event_id, obj_id, 0)
+                raise ticket_queue.PermanentError(f"Status code {exc.response.status_code}") from exc
+            raise
+        debug("Queued status_presence of ticket %s sent to Congressus.", obj_id)
+        await run_in_threadpool(queue_refresh, event_id, obj_id, ticket_queue.RECONCILE_DELAY_SECONDS)
+    elif item["action"] == "refresh":
+        # Re-fetching before a queued change went through would undo it locally
+        if await run_in_threadpool(ticket_queue.pending, "set-presence", event_id, [obj_id]):
+            return
+        data = await CONGRESSUS.get(path)
+        await run_in_threadpool(store_ticket, event_id, obj_id, data)
+    else:
+        raise ticket_queue.PermanentError(f"Unknown action {item['action']}")
+
+
+def tickets_to_collect(event_id: str) -> List[str]:
+    """
+    Function to select, in one query, the approved participations of an event whose
+    ticket is not cached yet or not marked present for every ticket.
+
+    :return: Participation ids to fetch
+    """
+
+    with connection(readonly=True) as conn:
+        rows = conn.execute(
+            """
+            SELECT p.participation_id, t.obj_id IS NULL OR t.status_presence IS NOT 'present'
+            FROM participations p
+            LEFT JOIN tickets t ON t.obj_id = p.participation_id AND t.event_id = p.event_id
+            WHERE p.event_id = ? AND p.status = 'approved'
+        """,
+            (event_id,),
+        ).fetchall()
+    to_fetch = [obj_id for obj_id, needs_fetch in rows if needs_fetch]
+    log(
+        "%d of %d approved participations already present, fetching %d.",
+        len(rows) - len(to_fetch),
+        len(rows),
+        len(to_fetch),
+    )
+    return to_fetch
+
+
+async def collect_tickets_for_event(event_id: str):
+    status = await sync_coordinator.single_flight(
+        f"participations:{event_id}", functools.partial(refresh_participations, event_id)
+    )
+    if status != "finished":
+        raise RuntimeError(f"Refreshing the participations of event {event_id} did not finish ({status})")
+    to_update = await run_in_threadpool(tickets_to_collect, event_id)
+    await jobs.progress(processed=0, total=len(to_update), message="Collecting tickets")
+
+    # Fetch with a concurrency that adapts to the upstream latency and error rate, and
+    # write the results in batches instead of one transaction per ticket.
+    limiter = congressus.AdaptiveLimiter()
+    writer = ticket_writer()
+    flushing = asyncio.Lock()
+    errors = 0
+    start = time.perf_counter()
+
+    async def fetch_ticket(obj_id: str):
+        nonlocal errors
+        try:
+            async with limiter.slot():
+                data = await CONGRESSUS.get(f"/events/{event_id}/participations/{obj_id}")
+        except Exception as exc:
+            errors += 1
+            sampled("Fetching ticket %s failed: %s", obj_id, exc, level=logging.WARNING, event_id=event_id)
+            await jobs.progress(advance=1, errors=errors)
+            return
+        writer.add(ticket_row(event_id, str(obj_id), data))
+        await jobs.progress(advance=1)
+        # One flush at a time; rows arriving meanwhile go into the next batch
+        if writer.full and not flushing.locked():
+            async with flushing:
+                await run_in_threadpool(writer.flush)
+            debug(
+                "Progress: %d/%d updated (concurrency %d).", writer.rows_written, len(to_update), int(limiter.limit)
+            )
+
+    tasks = [asyncio.create_task(fetch_ticket(obj_id)) for obj_id in to_update]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # After a failed flush the job fails; the other fetches would only spend rate limit tokens
+        for task in tasks:
+            task.cancel()
+    await run_in_threadpool(writer.flush)
+
+    seconds = time.perf_counter() - start
+    throughput = {
+        "fetched": writer.rows_written,
+        "errors": errors,
+        "seconds": round(seconds, 2),
+        "tickets_per_second": round(writer.rows_written / seconds, 1) if seconds else 0.0,
+        "rows_written_per_second": round(writer.rows_per_second),
+        "concurrency": limiter.stats(),
+    }
+    log("Refreshed ticket data for %d participations for event %s: %s", writer.rows_written, event_id, throughput)
+    return {"status": "success", "message": f"Collected tickets for event {event_id}.", "throughput": throughput}
 
 
 if __name__ == "__main__":
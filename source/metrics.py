@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+"""
+Prometheus metrics, aggregated across the uvicorn workers.
+
+Counters and histograms are kept in memory per worker. Every METRICS_PUBLISH_SECONDS a
+worker stores a snapshot of them in the metrics_snapshots table, but only when it changed
+since the last one, so an idle pod does not write. GET /metrics can be answered by any
+worker: it stores its own snapshot first and then renders only stored snapshots of the
+workers on this host, in the Prometheus text format. A stored snapshot never goes down,
+so whichever worker answers, a scrape shows at least what the previous one did.
+
+Snapshots of workers that stopped keep counting: after METRICS_RETENTION_SECONDS they are
+added to the metrics_retired totals of their host and deleted, so the totals of the pod
+never go backwards, which Prometheus would take for a counter reset.
+
+The queries of this module are not measured themselves, and neither are the probes and
+scrapes (UNMEASURED_ROUTES), which would otherwise change the snapshot every time.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from logger import warning
+
+
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "30"))
+METRICS_RETENTION_SECONDS = float(os.getenv("METRICS_RETENTION_SECONDS", str(24 * 60 * 60)))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+HOST = socket.gethostname()
+WORKER = f"{HOST}:{os.getpid()}:{int(time.time())}"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+UNMEASURED_ROUTES = {"/healthz", "/readyz", "/metrics"}
+
+_LOCK = threading.Lock()
+_METRICS: Dict[str, "Metric"] = {}
+_UNMEASURED = threading.local()
+# Last snapshot stored by publish(), and when
+_published: Tuple[Optional[str], float] = (None, 0.0)
+
+
+class Metric:
+    """
+    A counter or histogram with labels; values are kept per combination of label values.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], object] = {}
+        _METRICS[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def describe(self) -> Dict:
+        return {"kind": self.kind, "documentation": self.documentation, "labels": list(self.labels)}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        if getattr(_UNMEASURED, "active", False):
+            return
+        key = self._key(labels)
+        with _LOCK:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: str):
+        if getattr(_UNMEASURED, "active", False):
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _LOCK:
+            # Counts per bucket (the last one is +Inf), then the sum
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def describe(self) -> Dict:
+        return dict(super().describe(), buckets=list(self.buckets))
+
+
+@contextlib.contextmanager
+def unmeasured() -> Iterator[None]:
+    """
+    Function to stop recording metrics in this thread for the duration of the block.
+    """
+
+    _UNMEASURED.active = True
+    try:
+        yield
+    finally:
+        _UNMEASURED.active = False
+
+
+def snapshot() -> Dict:
+    """
+    Function to return the metrics of this worker as a JSON serializable dict.
+    """
+
+    with _LOCK:
+        return {
+            name: dict(metric.describe(), values=[[list(key), value] for key, value in metric.values.items()])
+            for name, metric in _METRICS.items()
+        }
+
+
+def merge(snapshots: List[Dict]) -> Dict:
+    """
+    Function to add up the snapshots of several workers.
+    """
+
+    merged: Dict[str, Dict] = {}
+    for worker_snapshot in snapshots:
+        for name, metric in worker_snapshot.items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            if target.get("buckets") != metric.get("buckets") or target["labels"] != metric["labels"]:
+                # Published by an older version with other buckets or labels
+                continue
+            for key, value in metric["values"]:
+                key = tuple(key)
+                if key not in target["values"]:
+                    target["values"][key] = value if not isinstance(value, list) else list(value)
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(target["values"][key], value, strict=True)]
+                else:
+                    target["values"][key] += value
+    return merged
+
+
+def as_snapshot(merged: Dict) -> Dict:
+    """
+    Function to turn merged metrics back into the JSON serializable form of snapshot().
+    """
+
+    return {
+        name: dict(metric, values=[[list(key), value] for key, value in metric["values"].items()])
+        for name, metric in merged.items()
+    }
+
+
+def format_labels(names: List[str], values, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values, strict=True)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped, strict=True)) + "}"
+
+
+def format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(metrics: Dict) -> str:
+    """
+    Function to render metrics in the Prometheus text exposition format.
+    """
+
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric["values"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{format_labels(metric['labels'], key)} {format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + ["+Inf"], value[:-1], strict=True):
+                cumulative += count
+                le = format_number(bound) if bound != "+Inf" else bound
+                labels = format_labels(metric["labels"], key, ("le", le))
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(metric['labels'], key)} {format_number(value[-1])}")
+            lines.append(f"{name}_count{format_labels(metric['labels'], key)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def create_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_snapshots (
+            worker TEXT PRIMARY KEY,
+            host TEXT,
+            updated REAL,
+            data TEXT
+        )
+    """
+    )
+
+
+def create_retired_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_retired (
+            host TEXT PRIMARY KEY,
+            data TEXT
+        )
+    """
+    )
+
+
+def retire(cursor, before: float):
+    """
+    Function to add the snapshots of workers that stopped publishing before the given
+    time to the retired totals of their host, and delete them.
+    """
+
+    rows = cursor.execute(
+        """
+        SELECT s.host, s.data, r.data FROM metrics_snapshots s LEFT JOIN metrics_retired r ON r.host = s.host
+        WHERE s.updated < ? ORDER BY s.host
+    """,
+        (before,),
+    ).fetchall()
+    snapshots: Dict[str, List[Dict]] = {}
+    for host, data, retired in rows:
+        if host not in snapshots:
+            snapshots[host] = [json.loads(retired)] if retired else []
+        snapshots[host].append(json.loads(data))
+    for host, host_snapshots in snapshots.items():
+        cursor.execute(
+            "INSERT INTO metrics_retired (host, data) VALUES (?, ?) ON CONFLICT(host) DO UPDATE SET data = excluded.data",
+            (host, json.dumps(as_snapshot(merge(host_snapshots)), separators=(",", ":"))),
+        )
+    cursor.execute("DELETE FROM metrics_snapshots WHERE updated < ?", (before,))
+
+
+def publish(connection: Callable) -> bool:
+    """
+    Function to store the snapshot of this worker when it changed, and retire those of
+    workers that stopped publishing long ago. An unchanged snapshot is still stored
+    once per half METRICS_RETENTION_SECONDS, so it is not retired itself.
+
+    :param connection: database.connection
+    :return: Whether the snapshot was stored
+    """
+
+    global _published
+    now = time.time()
+    data = json.dumps(snapshot(), separators=(",", ":"))
+    if data == _published[0] and now - _published[1] < METRICS_RETENTION_SECONDS / 2:
+        return False
+    with unmeasured(), connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO metrics_snapshots (worker, host, updated, data) VALUES (?, ?, ?, ?)
+            ON CONFLICT(worker) DO UPDATE SET updated = excluded.updated, data = excluded.data
+        """,
+            (WORKER, HOST, now, data),
+        )
+        retire(conn, now - METRICS_RETENTION_SECONDS)
+    _published = (data, now)
+    return True
+
+
+def collect(connection: Callable) -> str:
+    """
+    Function to render the metrics of all workers on this host. The snapshot of this
+    worker is stored first and only stored snapshots are rendered, so every worker
+    answers with the same totals.
+
+    :param connection: database.connection
+    """
+
+    publish(connection)
+    with unmeasured(), connection(readonly=True) as conn:
+        rows = conn.execute(
+            """
+            SELECT data FROM metrics_snapshots WHERE host = ?
+            UNION ALL SELECT data FROM metrics_retired WHERE host = ?
+        """,
+            (HOST, HOST),
+        ).fetchall()
+    return render(merge([json.loads(row[0]) for row in rows]))
+
+
+async def run(connection: Callable, interval: float = METRICS_PUBLISH_SECONDS):
+    """
+    Function to publish the snapshot of this worker periodically until cancelled, and
+    once more then, so a stopping worker keeps what it counted since the last time.
+    """
+
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(publish, connection)
+            except Exception as exc:
+                warning("Publishing metrics failed: %s", exc)
+    finally:
+        with contextlib.suppress(Exception):
+            await asyncio.to_thread(publish, connection)
+
+
+class Middleware:
+    """
+    ASGI middleware timing every HTTP request until its response starts, by route
+    template (e.g. /participations/{event_id}), so the labels stay few.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        started = False
+
+        def observe(status: int):
+            route = getattr(scope.get("route"), "path", "unmatched")
+            if route in UNMEASURED_ROUTES:
+                return
+            seconds = time.perf_counter() - start
+            HTTP_REQUEST_SECONDS.observe(seconds, method=scope["method"], route=route, status=str(status))
+
+        async def send_with_timing(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            if not started:
+                observe(500)
+            raise
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response of an HTTP request started, by route template.",
+    ("method", "route", "status"),
+)
+UPSTREAM_REQUESTS = Counter(
+    "congressus_requests_total",
+    "Congressus API calls, retries included, by endpoint and outcome.",
+    ("endpoint", "status"),
+)
+UPSTREAM_SECONDS = Histogram(
+    "congressus_request_duration_seconds", "Latency of Congressus API calls, by endpoint.", ("endpoint",)
+)
+SQLITE_TRANSACTION_SECONDS = Histogram(
+    "sqlite_transaction_duration_seconds", "Duration of SQLite transactions, lock wait included.", ("mode",)
+)
+SQLITE_LOCK_WAIT_SECONDS = Histogram(
+    "sqlite_lock_wait_seconds", "Time write transactions waited for the SQLite write lock."
+)
+JOB_SECONDS = Histogram(
+    "job_duration_seconds", "Duration of background jobs, by kind and outcome.", ("kind", "status"), DURATION_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    "response_cache_lookups_total", "Response cache lookups, by result (hit, miss or stale).", ("result",)
+)
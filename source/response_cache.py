@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""
+Bounded LRU cache of serialized responses, per worker.
+
+Every entry is stored with the ETag it was built for (see versions.py). The ETag is
+derived from the data version, which triggers bump in the same transaction as every
+write, so an entry is only served while its tag is still the current one. A write in
+any worker therefore invalidates the entry in all workers, without any messaging
+between them.
+"""
+
+import collections
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import metrics
+
+
+RESPONSE_CACHE_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "256"))
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+
+class ResponseCache:
+    """
+    LRU of (tag, body) by key, bounded by entry count and by total body size.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES, max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "collections.OrderedDict[str, Tuple[str, bytes]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, key: str, tag: str) -> Optional[bytes]:
+        """
+        Function to return the cached body of key if it was built for tag.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result = "miss"
+            elif entry[0] != tag:
+                result = "stale"
+                self._remove(key)
+            else:
+                result = "hit"
+                self._entries.move_to_end(key)
+            self._stats[{"miss": "misses", "stale": "stale", "hit": "hits"}[result]] += 1
+        metrics.CACHE_LOOKUPS.inc(result=result)
+        return entry[1] if result == "hit" else None
+
+    def put(self, key: str, tag: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (tag, body)
+            self.bytes += len(body)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, body = self._entries.pop(key)
+        self.bytes -= len(body)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"] + self._stats["stale"]
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self.bytes,
+                hit_ratio=round(self._stats["hits"] / lookups, 3) if lookups else None,
+            )
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+Startup phases and readiness of a worker.
+
+The lifespan of the app runs the phases of a cold start (migrations, warming the caches)
+through Startup.phase(), which times them. /healthz and /readyz answer from this state
+only, so the probes never touch the database or Congressus.
+"""
+
+import contextlib
+import os
+import time
+from typing import Dict, Iterator, Optional
+
+from logger import log
+
+
+# Import time of the first app module, so the report includes loading the code
+STARTED = time.perf_counter()
+
+
+class Startup:
+    """
+    Timings of the startup phases of this worker, and whether it is ready for traffic.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.failed: Optional[str] = None
+        self.ready_after: Optional[float] = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            self.failed = f"{name}: {exc}"
+            raise
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 3)
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_after = round(time.perf_counter() - STARTED, 3)
+        log("Worker %d ready after %ss: %s", os.getpid(), self.ready_after, self.phases)
+
+    def report(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "ready": self.ready,
+            "failed": self.failed,
+            "ready_after_seconds": self.ready_after,
+            "uptime_seconds": round(time.perf_counter() - STARTED, 3),
+            "phases": dict(self.phases),
+        }
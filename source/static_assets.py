@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+In-memory store of the dashboard files in html/.
+
+Every file is read and compressed once (gzip, and brotli when the brotli package is
+installed), and served with Last-Modified and an ETag per encoding. Scripts and
+stylesheets are also served under a fingerprinted name (e.g. index.1a2b3c4d5e.js) with a
+year of immutable caching; the pages refer to them by those names, so after the first
+visit a page load only revalidates the page itself. A changed file gets a new
+fingerprint, so a new deploy is picked up on the next page load.
+"""
+
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from typing import Dict, Optional
+
+import fastapi
+
+from logger import log
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "html")
+PAGE_CACHE_CONTROL = "no-cache"
+FINGERPRINTED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+}
+# Local references in the pages, e.g. src="index.js" or href="style.css"
+REFERENCE = re.compile(r'(?P<attribute>\b(?:src|href)=")(?P<name>[\w.-]+)(?=")')
+
+
+class Asset:
+    """
+    One file, with its compressed variants and validators.
+    """
+
+    def __init__(self, name: str, body: bytes, modified: float):
+        self.name = name
+        self.content_type = (
+            CONTENT_TYPES.get(os.path.splitext(name)[1]) or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        )
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.modified = int(modified)
+        self.last_modified = email.utils.formatdate(self.modified, usegmt=True)
+        self.bodies: Dict[str, bytes] = {"identity": body}
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body)
+        for encoding, variant in compressed.items():
+            if len(variant) < len(body):
+                self.bodies[encoding] = variant
+        # A strong tag is byte-exact, so every encoding has its own
+        self.etags = {
+            encoding: f'"{self.digest[:16]}"' if encoding == "identity" else f'"{self.digest[:16]}-{encoding}"'
+            for encoding in self.bodies
+        }
+
+    @property
+    def fingerprinted_name(self) -> str:
+        stem, extension = os.path.splitext(self.name)
+        return f"{stem}.{self.digest[:10]}{extension}"
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """
+    Function to pick the encoding to send from an Accept-Encoding header; brotli is
+    preferred over gzip.
+    """
+
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def not_modified_since(if_modified_since: Optional[str], modified: int) -> bool:
+    if not if_modified_since:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return since.timestamp() >= modified
+
+
+class StaticAssets:
+    """
+    The files of a directory, loaded on first use.
+    """
+
+    def __init__(self, directory: str = STATIC_DIRECTORY):
+        self.directory = directory
+        self._assets: Optional[Dict[str, Asset]] = None
+        # Both the plain and the fingerprinted name map to the asset
+        self._names: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Asset]:
+        if self._assets is not None:
+            return self._assets
+        with self._lock:
+            if self._assets is None:
+                assets = {}
+                files = [entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name[0] != "."]
+                # Pages last, as they refer to the fingerprinted names of the other files
+                for entry in sorted(files, key=lambda entry: (entry.name.endswith(".html"), entry.name)):
+                    with open(entry.path, "rb") as file:
+                        body = file.read()
+                    modified = entry.stat().st_mtime
+                    if entry.name.endswith(".html"):
+                        body = self._fingerprint_references(body.decode("utf-8"), assets).encode("utf-8")
+                        # A page changes with the files it refers to
+                        modified = max([modified] + [asset.modified for asset in assets.values()])
+                    assets[entry.name] = Asset(entry.name, body, modified)
+                self._names = dict(assets)
+                for asset in assets.values():
+                    if not asset.name.endswith(".html"):
+                        self._names[asset.fingerprinted_name] = asset
+                self._assets = assets
+                size = sum(len(asset.bodies["identity"]) for asset in assets.values())
+                log("Loaded %d static assets (%d bytes) from %s.", len(assets), size, self.directory)
+        return self._assets
+
+    @staticmethod
+    def _fingerprint_references(page: str, assets: Dict[str, Asset]) -> str:
+        def replace(match: re.Match) -> str:
+            asset = assets.get(match.group("name"))
+            # Pages are only served under their own name
+            if asset is None or asset.name.endswith(".html"):
+                return match.group(0)
+            return match.group("attribute") + asset.fingerprinted_name
+
+        return REFERENCE.sub(replace, page)
+
+    def response(self, request: fastapi.Request, name: str) -> Optional[fastapi.Response]:
+        """
+        Function to answer a request for a file, or None when there is no such file.
+
+        :param request: Request being answered, for its validators and Accept-Encoding
+        :param name: File name, plain or fingerprinted
+        """
+
+        self.load()
+        asset = self._names.get(name)
+        if asset is None:
+            return None
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), asset.bodies)
+        headers = {
+            "ETag": asset.etags[encoding],
+            "Last-Modified": asset.last_modified,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": FINGERPRINTED_CACHE_CONTROL if name != asset.name else PAGE_CACHE_CONTROL,
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+            if "*" in candidates or asset.etags[encoding] in candidates:
+                return fastapi.Response(status_code=304, headers=headers)
+        elif not_modified_since(request.headers.get("if-modified-since"), asset.modified):
+            return fastapi.Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return fastapi.Response(content=asset.bodies[encoding], media_type=asset.content_type, headers=headers)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+Single-flight coordination of syncs across uvicorn workers.
+
+Every sync (e.g. "events" or "participations:123") has one row in the sync_runs table.
+A worker that wants to run a sync claims it: when the same sync is already running in
+any worker, or finished less than SYNC_COALESCE_SECONDS ago, the caller attaches to
+that run instead of starting a new one. The running worker holds a lease that it
+renews while the sync runs, so a sync whose worker died can be claimed again once the
+lease expires. Every run is registered as a job with the run id as its id, so
+whoever started or attached to a run can follow it at GET /jobs/{run_id}.
+
+Syncs that include another sync, such as the participations of every event in the
+"events" sync, run it through single_flight() too, so they never duplicate a run of it.
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import jobs
+from database import connection
+from logger import warning
+
+
+SYNC_LEASE_SECONDS = int(os.getenv("SYNC_LEASE_SECONDS", "120"))
+SYNC_COALESCE_SECONDS = int(os.getenv("SYNC_COALESCE_SECONDS", "10"))
+# Retry of a failed lease renewal, well within the lease
+RENEW_RETRY_SECONDS = min(5.0, SYNC_LEASE_SECONDS / 12)
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def create_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_runs (
+            sync_key TEXT PRIMARY KEY,
+            run_id TEXT,
+            owner TEXT,
+            status TEXT,
+            started REAL,
+            finished REAL,
+            lease_expires REAL
+        )
+    """
+    )
+
+
+def claim(sync_key: str) -> Tuple[str, bool]:
+    """
+    Function to claim a sync for this worker.
+
+    :param sync_key: Name of the sync, e.g. "events" or "participations:123"
+    :return: (run_id, started). started is False when the caller was attached to a
+        sync that is running or has just finished. A started run is registered as a
+        job in the same transaction.
+    """
+
+    now = time.time()
+    # The write block takes the write lock up front (BEGIN IMMEDIATE), so two workers
+    # can't both claim
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT run_id, status, finished, lease_expires FROM sync_runs WHERE sync_key = ?",
+            (sync_key,),
+        ).fetchone()
+        if row is not None:
+            run_id, status, finished, lease_expires = row
+            if status == "running" and lease_expires > now:
+                return run_id, False
+            if status == "finished" and finished is not None and now - finished < SYNC_COALESCE_SECONDS:
+                return run_id, False
+
+        run_id = uuid.uuid4().hex
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO sync_runs (sync_key, run_id, owner, status, started, finished, lease_expires)
+            VALUES (?, ?, ?, 'running', ?, NULL, ?)
+        """,
+            (sync_key, run_id, OWNER, now, now + SYNC_LEASE_SECONDS),
+        )
+        jobs.create(run_id, sync_key)
+    return run_id, True
+
+
+def renew(sync_key: str, run_id: str):
+    with connection() as conn:
+        conn.execute(
+            "UPDATE sync_runs SET lease_expires = ? WHERE sync_key = ? AND run_id = ?",
+            (time.time() + SYNC_LEASE_SECONDS, sync_key, run_id),
+        )
+
+
+def release(sync_key: str, run_id: str, status: str):
+    with connection() as conn:
+        conn.execute(
+            """
+            UPDATE sync_runs SET status = ?, finished = ?, lease_expires = NULL
+            WHERE sync_key = ? AND run_id = ?
+        """,
+            (status, time.time(), sync_key, run_id),
+        )
+
+
+def get_run(sync_key: str) -> Optional[Dict]:
+    with connection(readonly=True) as conn:
+        row = conn.execute(
+            "SELECT run_id, owner, status, started, finished, lease_expires FROM sync_runs WHERE sync_key = ?",
+            (sync_key,),
+        ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(["run_id", "owner", "status", "started", "finished", "lease_expires"], row, strict=True))
+
+
+async def run(sync_key: str, run_id: str, sync: Callable[[], Awaitable]):
+    """
+    Function to execute a claimed sync as its job, renewing its lease while it runs
+    and releasing it as finished or failed afterwards.
+
+    :param sync_key: Name of the sync
+    :param run_id: Run id returned by claim()
+    :param sync: Coroutine function performing the actual sync
+    """
+
+    async def keep_lease():
+        delay = SYNC_LEASE_SECONDS / 3
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.to_thread(renew, sync_key, run_id)
+                delay = SYNC_LEASE_SECONDS / 3
+            except Exception as exc:
+                # E.g. database locked; if the lease expired another worker would start the same sync
+                warning("Renewing the lease of sync %s failed, retrying in %.1fs: %s", sync_key, RENEW_RETRY_SECONDS, exc)
+                delay = RENEW_RETRY_SECONDS
+
+    heartbeat = asyncio.create_task(keep_lease())
+    status = "failed"
+    try:
+        result = await jobs.run(run_id, sync, sync_key.split(":")[0])
+        status = "finished"
+        return result
+    finally:
+        heartbeat.cancel()
+        await asyncio.to_thread(release, sync_key, run_id, status)
+
+
+async def wait(sync_key: str, run_id: str, timeout: float = SYNC_LEASE_SECONDS, interval: float = 0.5) -> str:
+    """
+    Function to wait until a run (possibly in another worker) is no longer running.
+
+    :return: Final status of the run; "running" when the timeout expired first
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        current = await asyncio.to_thread(get_run, sync_key)
+        if current is None or current["run_id"] != run_id:
+            return "finished"
+        if current["status"] != "running" or (current["lease_expires"] or 0) < time.time():
+            return current["status"]
+        if time.monotonic() >= deadline:
+            return "running"
+        await asyncio.sleep(interval)
+
+
+async def single_flight(sync_key: str, sync: Callable[[], Awaitable]) -> str:
+    """
+    Function to run a sync in the foreground unless an equal sync is already
+    running or has just finished, in which case it waits for that one instead.
+
+    :return: Final status of the run that was executed or attached to
+    """
+
+    run_id, started = await asyncio.to_thread(claim, sync_key)
+    if not started:
+        return await wait(sync_key, run_id)
+    await run(sync_key, run_id, sync)
+    return "finished"
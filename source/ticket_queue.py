@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+"""
+Persistent queue of ticket work that is done after a check-in has been answered.
+
+A check-in updates the local tickets row as soon as Congressus accepted the presence
+change, and queues a "refresh" of the ticket that re-fetches it a little later and
+corrects any divergence. When Congressus can't be reached, the presence change itself
+is queued as "set-presence" and retried until it goes through, so scanning continues
+during short outages.
+
+The queue lives in SQLite, so it survives restarts and is shared by all uvicorn
+workers. Every worker runs a processor; items are claimed with a lease in a single
+UPDATE, so each item is handled by one worker at a time. The lease of an item is renewed
+when its turn in a slow batch comes, so it is not claimed by another worker meanwhile.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from database import connection
+from logger import warning
+
+
+RECONCILE_DELAY_SECONDS = float(os.getenv("RECONCILE_DELAY_SECONDS", "30"))
+QUEUE_POLL_SECONDS = float(os.getenv("TICKET_QUEUE_POLL_SECONDS", "2"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("TICKET_QUEUE_MAX_ATTEMPTS", "20"))
+QUEUE_LEASE_SECONDS = 60
+QUEUE_BATCH_SIZE = 20
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+FIELDS = ["item_id", "action", "event_id", "obj_id", "payload", "attempts", "due", "claimed_until", "last_error"]
+
+
+class PermanentError(Exception):
+    """
+    Raised by a processor for an item that must not be retried.
+    """
+
+
+def create_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ticket_queue (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT,
+            event_id TEXT,
+            obj_id TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            due REAL,
+            claimed_until REAL,
+            last_error TEXT,
+            created REAL,
+            UNIQUE (action, event_id, obj_id)
+        )
+    """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_queue_due ON ticket_queue(status, due)")
+
+
+def enqueue(cursor, action: str, event_id: str, obj_id: str, payload: Optional[Dict] = None, delay: float = 0):
+    """
+    Function to queue work for a ticket. Queuing the same action for the same ticket
+    again replaces the pending item, so only the latest presence change is sent. A
+    claimed item is released, so the new one does not wait for the lease to expire.
+
+    :param cursor: Cursor of the transaction that also holds the related local write
+    :param action: "set-presence" or "refresh"
+    :param delay: Seconds before the item is due
+    """
+
+    now = time.time()
+    cursor.execute(
+        """
+        INSERT INTO ticket_queue (action, event_id, obj_id, payload, status, attempts, due, created)
+        VALUES (?, ?, ?, ?, 'pending', 0, ?, ?)
+        ON CONFLICT(action, event_id, obj_id) DO UPDATE SET
+            payload = excluded.payload,
+            status = 'pending',
+            attempts = 0,
+            due = excluded.due,
+            claimed_until = NULL,
+            last_error = NULL
+    """,
+        (action, event_id, obj_id, json.dumps(payload) if payload is not None else None, now + delay, now),
+    )
+
+
+def discard(cursor, action: str, event_id: str, obj_id: str):
+    cursor.execute(
+        "DELETE FROM ticket_queue WHERE action = ? AND event_id = ? AND obj_id = ? AND status = 'pending'",
+        (action, event_id, obj_id),
+    )
+
+
+def pending(action: str, event_id: str, obj_ids: List[str]) -> Set[str]:
+    """
+    Function to return which of the given tickets have a pending item for action.
+    """
+
+    with connection(readonly=True) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT obj_id FROM ticket_queue
+            WHERE action = ? AND event_id = ? AND status = 'pending' AND obj_id IN ({", ".join("?" for _ in obj_ids)})
+        """,
+            [action, event_id, *obj_ids],
+        ).fetchall()
+    return {row[0] for row in rows}
+
+
+def claim(limit: int = QUEUE_BATCH_SIZE) -> List[Dict]:
+    """
+    Function to claim due items for this worker.
+
+    :return: Claimed items, oldest due first
+    """
+
+    now = time.time()
+    with connection() as conn:
+        rows = conn.execute(
+            f"""
+            UPDATE ticket_queue SET claimed_until = ?
+            WHERE item_id IN (
+                SELECT item_id FROM ticket_queue
+                WHERE status = 'pending' AND due <= ? AND (claimed_until IS NULL OR claimed_until < ?)
+                ORDER BY due LIMIT ?
+            )
+            RETURNING {", ".join(FIELDS)}
+        """,
+            (now + QUEUE_LEASE_SECONDS, now, now, limit),
+        ).fetchall()
+    items = [dict(zip(FIELDS, row, strict=True)) for row in rows]
+    for item in items:
+        item["payload"] = json.loads(item["payload"]) if item["payload"] else None
+    return items
+
+
+def renew(item: Dict) -> bool:
+    """
+    Function to extend the claim of an item that is about to be processed.
+
+    :return: False when the item was queued again or claimed by another worker since
+    """
+
+    claimed_until = time.time() + QUEUE_LEASE_SECONDS
+    with connection() as conn:
+        cursor = conn.execute(
+            "UPDATE ticket_queue SET claimed_until = ? WHERE item_id = ? AND due = ? AND claimed_until = ?",
+            (claimed_until, item["item_id"], item["due"], item["claimed_until"]),
+        )
+    if cursor.rowcount != 1:
+        return False
+    item["claimed_until"] = claimed_until
+    return True
+
+
+def complete(item: Dict):
+    with connection() as conn:
+        # An item queued again while it was processed (new due time) stays queued
+        conn.execute("DELETE FROM ticket_queue WHERE item_id = ? AND due = ?", (item["item_id"], item["due"]))
+
+
+def fail(item: Dict, error: str, permanent: bool = False):
+    attempts = item["attempts"] + 1
+    status = "failed" if permanent or attempts >= QUEUE_MAX_ATTEMPTS else "pending"
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    with connection() as conn:
+        conn.execute(
+            """
+            UPDATE ticket_queue SET status = ?, attempts = ?, due = ?, claimed_until = NULL, last_error = ?
+            WHERE item_id = ? AND due = ?
+        """,
+            (status, attempts, time.time() + delay, error, item["item_id"], item["due"]),
+        )
+    warning("Queued %s of ticket %s failed (%dx, %s): %s", item["action"], item["obj_id"], attempts, status, error)
+
+
+def stats() -> Dict:
+    with connection(readonly=True) as conn:
+        rows = conn.execute("SELECT action, status, COUNT(*) FROM ticket_queue GROUP BY action, status").fetchall()
+    return {f"{action}:{status}": count for action, status, count in rows}
+
+
+async def run(process: Callable[[Dict], Awaitable], interval: float = QUEUE_POLL_SECONDS):
+    """
+    Function to process due items until cancelled.
+
+    :param process: Coroutine function handling one item; raising fails the item and
+        schedules a retry with backoff, raising PermanentError fails it for good
+    :param interval: Seconds between polls when the queue has no due items
+    """
+
+    while True:
+        try:
+            items = await asyncio.to_thread(claim)
+        except Exception as exc:
+            warning("Claiming ticket queue items failed: %s", exc)
+            items = []
+        for item in items:
+            # Items earlier in the batch took long, e.g. timeouts during an outage
+            if time.time() > item["claimed_until"] - QUEUE_LEASE_SECONDS / 2:
+                try:
+                    renewed = await asyncio.to_thread(renew, item)
+                except Exception as exc:
+                    warning("Renewing the claim of ticket queue item %s failed: %s", item["item_id"], exc)
+                    renewed = False
+                if not renewed:
+                    continue
+            try:
+                await process(item)
+            except PermanentError as exc:
+                await asyncio.to_thread(fail, item, str(exc), True)
+            except Exception as exc:
+                # httpx errors carry a second line with a documentation link
+                message = str(exc).splitlines()[0] if str(exc) else ""
+                await asyncio.to_thread(fail, item, f"{type(exc).__name__}: {message}")
+            else:
+                await asyncio.to_thread(complete, item)
+        if len(items) < QUEUE_BATCH_SIZE:
+            await asyncio.sleep(interval)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Data versions for conditional GET requests.
+
+Triggers bump a counter in data_versions in the same transaction as every write to the
+cached tables: "events" for the event list, and "event:<id>" for everything shown
+about one event (its participations, tickets and stats). A response's ETag is derived
+from the counter, so answering If-None-Match takes one indexed read, without loading or
+serializing the data itself.
+"""
+
+import hashlib
+from typing import Dict, Optional
+
+import fastapi
+
+from database import connection
+
+
+HEADERS = {"Cache-Control": "no-cache"}
+
+
+def create_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """
+    )
+    bump = (
+        "INSERT INTO data_versions (scope, version) VALUES ({0}, 1) "
+        "ON CONFLICT(scope) DO UPDATE SET version = version + 1;"
+    )
+    event = "'event:' || {0}.event_id"
+    sources = {
+        # table: (scopes bumped per row, extra condition for updates)
+        "events": (["'events'", event], None),
+        "event_stats": (["'events'", event], None),
+        "participations": ([event], None),
+        "tickets": ([event], "OLD.data IS NOT NEW.data"),
+    }
+    for table, (scopes, update_condition) in sources.items():
+        for operation, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            when = f"WHEN {update_condition}" if operation == "UPDATE" and update_condition else ""
+            statements = " ".join(bump.format(scope.format(row)) for scope in scopes)
+            cursor.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{operation.lower()}
+                AFTER {operation} ON {table} {when}
+                BEGIN {statements} END
+            """
+            )
+
+
+def current(scope: str) -> int:
+    with connection(readonly=True) as conn:
+        row = conn.execute("SELECT version FROM data_versions WHERE scope = ?", (scope,)).fetchone()
+    return row[0] if row else 0
+
+
+def etag(request: fastapi.Request, scope: str, extra: str = "") -> str:
+    """
+    Function to compute the ETag of a response built from the data in scope.
+    The query string is part of the tag, as it may select a different representation.
+    The tag is weak, as GZipMiddleware sends the same data compressed or not.
+
+    :param request: Request being answered
+    :param scope: Data version scope, e.g. "events" or "event:123"
+    :param extra: Version of other data in the response that is not in the database
+    """
+
+    tag = f"{scope.replace(':', '-')}-{current(scope)}"
+    if request.url.query or extra:
+        tag += "-" + hashlib.sha1(f"{request.url.query}|{extra}".encode("utf-8")).hexdigest()[:12]
+    return f'W/"{tag}"'
+
+
+def headers(tag: str) -> Dict[str, str]:
+    return dict(HEADERS, ETag=tag)
+
+
+def not_modified(request: fastapi.Request, tag: str) -> Optional[fastapi.Response]:
+    """
+    Function to answer a conditional request whose If-None-Match holds the current tag.
+
+    :return: A 304 response, or None when the full response has to be sent
+    """
+
+    candidates = [value.strip() for value in request.headers.get("if-none-match", "").split(",")]
+    # If-None-Match uses the weak comparison
+    if "*" in candidates or tag.removeprefix("W/") in [value.removeprefix("W/") for value in candidates]:
+        return fastapi.Response(status_code=304, headers=headers(tag))
+    return None
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmarks of the data-shaping hot paths of the backend, on a synthetic database.
+
+Builds a SQLite database of --events events with --participations participations each
+and --tickets tickets per participation through the same write path the app uses
+(store_events, store_participations and the ticket BulkWriter), then times:
+
+- filter_events: ticket capacities of every event
+- strip_values: whitespace normalization of every nested participation object
+- filter_tickets: public projection of every ticket
+- get_participations: the overview read path of every event, joined with the presence
+  counts of the tickets, as dicts and as stored JSON
+- kenteken_normalize: normalization of license plates typed in several ways
+
+Every benchmark runs --repeat times, each run repeating the work for at least
+MIN_RUN_SECONDS; the fastest run counts, as it is the least disturbed by the rest of
+the machine. Results are compared with a baseline JSON file and the script exits with 1
+when a benchmark got slower than --threshold. Baselines only compare on the same machine
+and sizes, so record one with --save before a change:
+
+    python testing/benchmark.py --save
+    (make the change)
+    python testing/benchmark.py
+"""
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import string
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+WORKING_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRECTORY = os.path.join(WORKING_DIRECTORY, "..", "source")
+DEFAULT_BASELINE = os.path.join(WORKING_DIRECTORY, "benchmark_baseline.json")
+MIN_RUN_SECONDS = 0.05
+BENCHMARK_NAMES = [
+    "filter_events",
+    "strip_values",
+    "filter_tickets",
+    "get_participations",
+    "get_participations_encoded",
+    "kenteken_normalize",
+]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the data-shaping hot paths on a synthetic database.")
+    parser.add_argument("--events", type=int, default=50, help="Number of events (default 50)")
+    parser.add_argument("--participations", type=int, default=200, help="Participations per event (default 200)")
+    parser.add_argument("--tickets", type=int, default=2, help="Tickets per participation (default 2)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark (default 5)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic data (default 1)")
+    parser.add_argument("--only", action="append", choices=BENCHMARK_NAMES, help="Only run this benchmark (repeatable)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="Allowed slowdown against the baseline (default 0.25 = 25%%)"
+    )
+    return parser.parse_args()
+
+
+def random_plate(rng: random.Random) -> str:
+    """
+    Function to make a license plate in one of the Dutch formats, typed the way people
+    type them: with or without dashes, in upper or lower case.
+    """
+
+    letters = "BDFGHJKLNPRSTVXZ"
+    pattern = rng.choice(["XX-99-99", "99-XX-99", "99-99-XX", "XX-999-X", "X-999-XX", "99-XXX-9", "9-XXX-99"])
+    plate = "".join(rng.choice(letters) if c == "X" else rng.choice(string.digits) if c == "9" else c for c in pattern)
+    if rng.random() < 0.5:
+        plate = plate.replace("-", "")
+    return plate.lower() if rng.random() < 0.3 else plate
+
+
+def synthetic_data(events: int, participations: int, tickets: int, seed: int) -> Tuple[List, Dict, Dict]:
+    """
+    Function to generate events, participations per event and ticket details per
+    participation, shaped like the Congressus API responses.
+    """
+
+    rng = random.Random(seed)
+    event_list = []
+    participations_per_event = {}
+    ticket_data = {}
+    participation_id = 100000
+    for event_id in range(1, events + 1):
+        start = f"2026-{1 + event_id % 12:02d}-{1 + event_id % 28:02d}T19:00:00"
+        event_list.append(
+            {
+                "id": event_id,
+                "name": f" Event {event_id} ",
+                "start": start,
+                "published": event_id % 10 != 0,
+                "ticket_types": [
+                    {"name": "Lid", "price": 0, "num_tickets": rng.randint(50, 500)},
+                    {"name": "Niet lid", "price": 45, "num_tickets": rng.randint(10, 100)},
+                    {"name": "Vrijwilliger", "price": 10, "num_tickets": None},
+                ],
+            }
+        )
+        participations_per_event[event_id] = []
+        for index in range(participations):
+            participation_id += 1
+            status = "approved" if index % 7 else "waiting list"
+            participation = {
+                "id": participation_id,
+                "member_id": participation_id if index % 3 else None,
+                "status": status,
+                "addressee": f"  Person {participation_id} ",
+                "email": f"person{participation_id}@example.nl ",
+                "address": {"street": " Dorpsstraat ", "number": f"{index} ", "city": " Utrecht"},
+                "custom_fields": [{"name": " Dieet ", "value": rng.choice([" vegetarisch", "geen ", ""])}],
+            }
+            participations_per_event[event_id].append(participation)
+            ticket_data[(str(event_id), str(participation_id))] = {
+                "id": participation_id,
+                "addressee": participation["addressee"].strip(),
+                "email": participation["email"].strip(),
+                "status": status,
+                "event": {"name": f"Event {event_id}", "start": start},
+                "tickets": [
+                    {
+                        "id": participation_id * 10 + number,
+                        "status_presence": rng.choice(["present", "unknown", "unknown"]),
+                        "ticket_type": {"name": "Lid", "price": 0},
+                    }
+                    for number in range(tickets)
+                ],
+            }
+    return event_list, participations_per_event, ticket_data
+
+
+def build_database(main, event_list: List, participations_per_event: Dict, ticket_data: Dict):
+    """
+    Function to fill the database through the write path of the app, so the derived
+    columns, indexes and event_stats look like production.
+    """
+
+    main.init_db()
+    main.store_events(event_list)
+    for event_id, participations in participations_per_event.items():
+        main.store_participations(str(event_id), participations)
+    writer = main.ticket_writer()
+    for (event_id, obj_id), data in ticket_data.items():
+        writer.add(main.ticket_row(event_id, obj_id, data))
+    writer.flush()
+
+
+def measure(function: Callable, repeat: int) -> Dict:
+    """
+    Function to time one pass of a benchmark; a pass that takes less than
+    MIN_RUN_SECONDS is repeated, and timed as the average of the repetitions.
+    """
+
+    runs = []
+    for _ in range(repeat):
+        passes = 0
+        start = time.perf_counter()
+        while True:
+            items = function()
+            passes += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_RUN_SECONDS:
+                break
+        runs.append(elapsed / passes)
+    best = min(runs)
+    return {
+        "best_seconds": round(best, 9),
+        "median_seconds": round(statistics.median(runs), 9),
+        "items": items,
+        "microseconds_per_item": round(best / items * 1e6, 3) if items else None,
+    }
+
+
+def benchmarks(main, kentekens, event_list: List, participations_per_event: Dict, ticket_data: Dict, plates: List):
+    """
+    Function to return the benchmarks by name; each returns the number of items it
+    processed.
+    """
+
+    event_ids = [str(event_id) for event_id in participations_per_event]
+    participations = [p for event_participations in participations_per_event.values() for p in event_participations]
+    tickets = list(ticket_data.values())
+
+    def filter_events():
+        for event in event_list:
+            main.filter_events(event)
+        return len(event_list)
+
+    def strip_values():
+        for participation in participations:
+            main.strip_values(participation)
+        return len(participations)
+
+    def filter_tickets():
+        for ticket in tickets:
+            main.filter_tickets(ticket)
+        return len(tickets)
+
+    def get_participations():
+        return sum(len(main.get_participations(event_id)) for event_id in event_ids)
+
+    def get_participations_encoded():
+        return sum(len(main.get_participations(event_id, encoded=True)) for event_id in event_ids)
+
+    def kenteken_normalize():
+        for plate in plates:
+            kentekens.normalize(plate)
+        return len(plates)
+
+    return {
+        "filter_events": filter_events,
+        "strip_values": strip_values,
+        "filter_tickets": filter_tickets,
+        "get_participations": get_participations,
+        "get_participations_encoded": get_participations_encoded,
+        "kenteken_normalize": kenteken_normalize,
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Function to print the results next to the baseline, and return the names of the
+    benchmarks that got slower than the threshold allows.
+    """
+
+    regressions = []
+    print(f"{'benchmark':<28} {'best ms':>10} {'median ms':>10} {'us/item':>9} {'baseline ms':>12} {'change':>8}")
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        change = ""
+        if previous and previous["best_seconds"]:
+            ratio = result["best_seconds"] / previous["best_seconds"] - 1
+            change = f"{ratio:+.1%}"
+            if ratio > threshold:
+                regressions.append(name)
+                change += " !"
+        previous_ms = f"{previous['best_seconds'] * 1000:.3f}" if previous else "-"
+        print(
+            f"{name:<28} {result['best_seconds'] * 1000:>10.3f} {result['median_seconds'] * 1000:>10.3f} "
+            f"{result['microseconds_per_item'] or 0:>9.2f} {previous_ms:>12} {change:>8}"
+        )
+    return regressions
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp(prefix="congressus-benchmark-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    rng = random.Random(args.seed)
+    event_list, participations_per_event, ticket_data = synthetic_data(
+        args.events, args.participations, args.tickets, args.seed
+    )
+    plates = [random_plate(rng) for _ in range(len(ticket_data))]
+    kentekens_file = os.path.join(directory, "kenteken.json")
+    with open(kentekens_file, "w") as file:
+        json.dump({str(obj_id): plate for (_, obj_id), plate in zip(ticket_data, plates, strict=True)}, file)
+
+    # The app reads its configuration at import
+    os.environ["CONGRESSUS_CACHE_DB"] = os.path.join(directory, "benchmark.db")
+    os.environ["KENTEKENS_FILE"] = kentekens_file
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, SOURCE_DIRECTORY)
+    import main as app
+    import kentekens
+
+    start = time.perf_counter()
+    build_database(app, event_list, participations_per_event, ticket_data)
+    print(
+        f"Built a database with {len(event_list)} events, "
+        f"{sum(map(len, participations_per_event.values()))} participations and "
+        f"{len(ticket_data) * args.tickets} tickets in {time.perf_counter() - start:.1f}s."
+    )
+
+    selected = benchmarks(app, kentekens, event_list, participations_per_event, ticket_data, plates)
+    if args.only:
+        selected = {name: function for name, function in selected.items() if name in args.only}
+    results = {name: measure(function, args.repeat) for name, function in selected.items()}
+
+    config = {
+        "events": args.events,
+        "participations": args.participations,
+        "tickets": args.tickets,
+        "seed": args.seed,
+    }
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != config:
+            print(f"Baseline {args.baseline} was recorded with {baseline.get('config')}, not comparing.")
+            baseline = {}
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        # Keep the baseline of benchmarks that were not run this time
+        saved = dict(baseline.get("results", {}), **results)
+        with open(args.baseline, "w") as file:
+            json.dump(
+                {
+                    "config": config,
+                    "recorded": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "python": platform.python_version(),
+                    "sqlite": sqlite3.sqlite_version,
+                    "machine": platform.node(),
+                    "results": saved,
+                },
+                file,
+                indent=2,
+            )
+        print(f"Stored the results as baseline in {args.baseline}.")
+    elif regressions:
+        print(f"Slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()